@@ -7,6 +7,7 @@ It does not work if the nodes outside of the graph are not in the scene with the
 import logging
 import itertools
 import maya.cmds as cmds
+import lib.libmaya as libmaya
 logger = logging.getLogger(__name__)
 
 
@@ -114,6 +115,7 @@ class AutoRigger(object):
         print 'expressions =', self.expressions
 
 
+    @libmaya.bulkEdit('Recreate graph')
     def recreate(self):
         self.createnodes()
         self.createAttributes()
@@ -0,0 +1,35 @@
+import timeit
+num = 5
+count = 2000
+
+# Create count multiplyDivide nodes, set two attributes on each and chain them, in a new scene for each run
+
+s = """
+import maya.cmds as cmds
+cmds.file(new=True, force=True)
+previous = None
+for i in xrange(%s):
+    node = cmds.createNode('multiplyDivide')
+    cmds.setAttr(node + '.input2X', 0.5)
+    cmds.setAttr(node + '.operation', 2)
+    if previous:
+        cmds.connectAttr(previous + '.outputX', node + '.input1X')
+    previous = node
+""" % count
+print timeit.timeit(s, number=num)
+
+s = """
+import maya.cmds as cmds
+import lib.libmaya as libmaya
+cmds.file(new=True, force=True)
+previous = None
+with libmaya.BatchModifier() as batch:
+    for i in xrange(%s):
+        node = batch.createNode('multiplyDivide')
+        batch.setAttr((node, 'input2X'), 0.5)
+        batch.setAttr((node, 'operation'), 2)
+        if previous:
+            batch.connectAttr((previous, 'outputX'), (node, 'input1X'))
+        previous = node
+""" % count
+print timeit.timeit(s, number=num)
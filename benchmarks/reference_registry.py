@@ -0,0 +1,37 @@
+import timeit
+num = 10
+
+# Run in a scene with references, the registry is rebuilt before each run to include its build time
+
+s = """
+import maya.cmds as cmds
+references = cmds.file(query=True, reference=True)
+referencesDict = dict()
+for ref in references:
+    refNode = cmds.file(ref, query=True, referenceNode=True)
+    isLoaded = cmds.referenceQuery(refNode, isLoaded=True)
+    nodesInRef = cmds.referenceQuery(refNode, nodes=True)
+    referencesDict[ref] = [refNode, nodesInRef, isLoaded]
+"""
+print timeit.timeit(s, number=num)
+
+s = """
+import lib.libmaya as libmaya
+libmaya.getReferenceRegistry().invalidate()
+libmaya.listReferences()
+"""
+print timeit.timeit(s, number=num)
+
+s = """
+import lib.libmaya as libmaya
+libmaya.listReferences()
+"""
+print timeit.timeit(s, number=num)
+
+# getIncrementedNamespace for every reference, as done by fixReferences
+s = """
+import lib.libmaya as libmaya
+for values in libmaya.getReferences().values():
+    libmaya.getIncrementedNamespace(values['namespace'], separator='_', padding=3)
+"""
+print timeit.timeit(s, number=num)
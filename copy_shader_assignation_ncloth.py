@@ -18,11 +18,10 @@ for sel in selection:
         pass
 
 
-shadingGroups = list(tdLib.flatten([tdLib.getSGsFromShape(i) for i in OBJS]))
-shaders = [tdLib.getMaterialFromSG(i) for i in shadingGroups]
+shadingIndex = tdLib.ShadingIndex()
 assignation = {}
-for i in shaders:
-    assignation[i] = tdLib.getShaderAssignation(i)
+for i in shadingIndex.materialsOf(OBJS):
+    assignation[i] = shadingIndex.assignation(i)
 
 
 objs = {}
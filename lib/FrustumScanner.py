@@ -12,7 +12,180 @@
 ##
 ####################################################################################
 
+import math
+import time
+import logging
+import maya.cmds as cmds
 import maya.OpenMaya as OpenMaya
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import libmaya
+import libpython
+import visibility
+logger = logging.getLogger(__name__)
+
+OUTSIDE = 0
+INTERSECT = 1
+INSIDE = 2
+
+# Index of the min (0) or max (1) value on each axis for the 8 corners, same order as dkbObjectsInCameraView
+BOX_CORNERS = ((0, 0, 0), (1, 0, 0), (1, 0, 1), (0, 0, 1), (0, 1, 0), (1, 1, 0), (1, 1, 1), (0, 1, 1))
+
+
+def getDagPath(node):
+    selectionList = OpenMaya.MSelectionList()
+    dagPath = OpenMaya.MDagPath()
+    selectionList.add(node)
+    selectionList.getDagPath(0, dagPath)
+    return dagPath
+
+
+def mmatrixToArray(matrix):
+    """Convert a MMatrix to a (4, 4) array, rows are kept so points are still multiplied on the left"""
+    return numpy.array([[matrix(i, j) for j in xrange(4)] for i in xrange(4)])
+
+
+def getLocalBounds(dagPaths):
+    """Return the object space bounding boxes as a (N, 2, 3) array of min/max and the exclusive matrices as a (N, 4, 4) array"""
+    bounds = numpy.empty((len(dagPaths), 2, 3))
+    matrices = numpy.empty((len(dagPaths), 4, 4))
+    for i, dagPath in enumerate(dagPaths):
+        bbox = OpenMaya.MFnDagNode(dagPath).boundingBox()
+        bboxMin, bboxMax = bbox.min(), bbox.max()
+        bounds[i] = ((bboxMin.x, bboxMin.y, bboxMin.z), (bboxMax.x, bboxMax.y, bboxMax.z))
+        matrices[i] = mmatrixToArray(dagPath.exclusiveMatrix())
+    return bounds, matrices
+
+
+def boxCorners(bounds):
+    """Expand a (N, 2, 3) array of min/max into a (N, 8, 4) array of homogeneous corners"""
+    corners = numpy.ones((len(bounds), 8, 4))
+    for k, corner in enumerate(BOX_CORNERS):
+        for axis in xrange(3):
+            corners[:, k, axis] = bounds[:, corner[axis], axis]
+    return corners
+
+
+def getWorldCorners(nodes):
+    """Return the world space corners of the bounding box of every node as a (N, 8, 4) array"""
+    bounds, matrices = getLocalBounds([getDagPath(node) for node in nodes])
+    return numpy.einsum('nkj,nji->nki', boxCorners(bounds), matrices)
+
+
+def timeContext(frame):
+    """Return a context evaluating the plugs at a given frame without changing the current time"""
+    return OpenMaya.MDGContext(OpenMaya.MTime(frame, OpenMaya.MTime.uiUnit()))
+
+
+def matrixPlugValue(plug, context):
+    return OpenMaya.MFnMatrixData(plug.asMObject(context)).matrix()
+
+
+CAMERA_ATTRIBUTES = ('focalLength', 'horizontalFilmAperture', 'verticalFilmAperture', 'horizontalFilmOffset', 'verticalFilmOffset',
+                     'lensSqueezeRatio', 'filmFit', 'cameraScale', 'orthographic', 'orthographicWidth', 'nearClipPlane', 'farClipPlane')
+
+
+def cameraValues(camDagPath, context=None):
+    """Read the attributes defining the frustum of a camera, at the time of the context if one is given"""
+    if context is None:
+        context = OpenMaya.MDGContext()
+    shapePath = OpenMaya.MDagPath(camDagPath)
+    if shapePath.apiType() == OpenMaya.MFn.kTransform:
+        shapePath.extendToShape()
+    fnDag = OpenMaya.MFnDagNode(shapePath)
+    values = dict((attr, fnDag.findPlug(attr).asDouble(context)) for attr in CAMERA_ATTRIBUTES)
+    values['worldMatrix'] = matrixPlugValue(fnDag.findPlug('worldMatrix').elementByLogicalIndex(shapePath.instanceNumber()), context)
+    return values
+
+
+def cameraSignature(camDagPath, context=None):
+    """Return all the values defining the frustum of a camera: world matrix, focal length, film back and clip planes"""
+    values = cameraValues(camDagPath, context)
+    worldMatrix = values.pop('worldMatrix')
+    return tuple(worldMatrix(i, j) for i in xrange(4) for j in xrange(4)) + tuple(values[attr] for attr in CAMERA_ATTRIBUTES)
+
+
+class TimeSampler():
+    """Evaluate the world bounding boxes of nodes at any frame through a MDGContext, without changing the current time.
+    Only the plugs of the nodes are evaluated instead of the whole scene.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self.plugs = []
+        for node in self.nodes:
+            dagPath = getDagPath(node)
+            fnDag = OpenMaya.MFnDagNode(dagPath)
+            bboxMin = fnDag.findPlug('boundingBoxMin')
+            bboxMax = fnDag.findPlug('boundingBoxMax')
+            self.plugs.append((fnDag.findPlug('parentMatrix').elementByLogicalIndex(dagPath.instanceNumber()),
+                               [bboxMin.child(i) for i in xrange(3)],
+                               [bboxMax.child(i) for i in xrange(3)]))
+
+    def sample(self, frames):
+        """Return the world corners of the nodes at each frame as a (F, N, 8, 4) array.
+        All the frames of a node are evaluated in one pass.
+        """
+        contexts = [timeContext(frame) for frame in frames]
+        bounds = numpy.empty((len(frames), len(self.nodes), 2, 3))
+        matrices = numpy.empty((len(frames), len(self.nodes), 4, 4))
+        for n, (parentMatrix, bboxMin, bboxMax) in enumerate(self.plugs):
+            for f, context in enumerate(contexts):
+                matrices[f, n] = mmatrixToArray(matrixPlugValue(parentMatrix, context))
+                bounds[f, n, 0] = [plug.asDouble(context) for plug in bboxMin]
+                bounds[f, n, 1] = [plug.asDouble(context) for plug in bboxMax]
+        corners = boxCorners(bounds.reshape(-1, 2, 3)).reshape(len(frames), len(self.nodes), 8, 4)
+        return numpy.einsum('fnkj,fnji->fnki', corners, matrices)
+
+
+def viewingFrustum(fnCamera, aspectRatio):
+    """Return the left, right, bottom and top of the frustum on the near clip plane, fitted to the aspect ratio with the film fit of the camera"""
+    left_util = OpenMaya.MScriptUtil()
+    left_util.createFromDouble(0.0)
+    ptr0 = left_util.asDoublePtr()
+
+    right_util = OpenMaya.MScriptUtil()
+    right_util.createFromDouble(0.0)
+    ptr1 = right_util.asDoublePtr()
+
+    bot_util = OpenMaya.MScriptUtil()
+    bot_util.createFromDouble(0.0)
+    ptr2 = bot_util.asDoublePtr()
+
+    top_util = OpenMaya.MScriptUtil()
+    top_util.createFromDouble(0.0)
+    ptr3 = top_util.asDoublePtr()
+
+    fnCamera.getViewingFrustum(aspectRatio, ptr0, ptr1, ptr2, ptr3, False, True)
+
+    left = left_util.getDoubleArrayItem(ptr0, 0)
+    right = right_util.getDoubleArrayItem(ptr1, 0)
+    bottom = bot_util.getDoubleArrayItem(ptr2, 0)
+    top = top_util.getDoubleArrayItem(ptr3, 0)
+    return left, right, bottom, top
+
+
+def fittedFilmWidth(values, aspectRatio):
+    """Return the width of the film back fitted to the aspect ratio with the film fit of the camera (0 fill, 1 horizontal, 2 vertical, 3 overscan).
+    The frustum of a perspective camera is proportional to it on both axes, the height follows from the aspect ratio.
+    """
+    width = values['horizontalFilmAperture'] * values['lensSqueezeRatio']
+    height = values['verticalFilmAperture']
+    fit = int(values['filmFit'])
+    if fit in (0, 3):
+        wider = aspectRatio > width / height
+        fit = 1 if wider == (fit == 0) else 2
+    return width if fit == 1 else height * aspectRatio
+
+
+def renderResolution():
+    """Return the width, height and pixel aspect of the render globals"""
+    return (cmds.getAttr('defaultResolution.width'),
+            cmds.getAttr('defaultResolution.height'),
+            cmds.getAttr('defaultResolution.pixelAspect'))
 
 
 class plane():
@@ -34,42 +207,34 @@ class plane():
 
 class frustum():
 
-    def __init__(self, cameraName):
+    def __init__(self, cameraName, objDagPath=None, context=None):
         # Initialising selected transforms into its associated dagPaths
-        selectionList = OpenMaya.MSelectionList()
-        objDagPath = OpenMaya.MDagPath()
-        selectionList.add(cameraName)
-        selectionList.getDagPath(0, objDagPath)
+        if objDagPath is None:
+            objDagPath = getDagPath(cameraName)
         self.camera = OpenMaya.MFnCamera(objDagPath)
+        self.camInvWorldMtx = objDagPath.inclusiveMatrixInverse()
 
         self.nearClip = self.camera.nearClippingPlane()
         self.farClip = self.camera.farClippingPlane()
         self.aspectRatio = self.camera.aspectRatio()
-
-        left_util = OpenMaya.MScriptUtil()
-        left_util.createFromDouble(0.0)
-        ptr0 = left_util.asDoublePtr()
-
-        right_util = OpenMaya.MScriptUtil()
-        right_util.createFromDouble(0.0)
-        ptr1 = right_util.asDoublePtr()
-
-        bot_util = OpenMaya.MScriptUtil()
-        bot_util.createFromDouble(0.0)
-        ptr2 = bot_util.asDoublePtr()
-
-        top_util = OpenMaya.MScriptUtil()
-        top_util.createFromDouble(0.0)
-        ptr3 = top_util.asDoublePtr()
-
-        stat = self.camera.getViewingFrustum(self.aspectRatio, ptr0, ptr1, ptr2, ptr3, False, True)
+        self.orthographic = self.camera.isOrtho()
 
         planes = []
 
-        left = left_util.getDoubleArrayItem(ptr0, 0)
-        right = right_util.getDoubleArrayItem(ptr1, 0)
-        bottom = bot_util.getDoubleArrayItem(ptr2, 0)
-        top = top_util.getDoubleArrayItem(ptr3, 0)
+        left, right, bottom, top = viewingFrustum(self.camera, self.aspectRatio)
+
+        if context is not None:
+            # Scale the frustum of the current time to the focal length, fitted film back, orthographic width and clip planes at the time of the context
+            # The film offsets and the type of camera are the ones of the current time
+            now, then = cameraValues(objDagPath), cameraValues(objDagPath, context)
+            self.camInvWorldMtx = then['worldMatrix'].inverse()
+            if self.orthographic:
+                scale = then['orthographicWidth'] / now['orthographicWidth']
+            else:
+                scale = now['focalLength'] / then['focalLength'] * then['nearClipPlane'] / now['nearClipPlane'] * then['cameraScale'] / now['cameraScale']
+                scale *= fittedFilmWidth(then, self.aspectRatio) / fittedFilmWidth(now, self.aspectRatio)
+            left, right, bottom, top = left * scale, right * scale, bottom * scale, top * scale
+            self.nearClip, self.farClip = then['nearClipPlane'], then['farClipPlane']
 
         # planeA = right plane
         a = OpenMaya.MVector(right, top, -self.nearClip)
@@ -111,6 +276,13 @@ class frustum():
         planeF.distance = self.nearClip
         planes.append(planeF)
 
+        if self.orthographic:
+            # The sides of an orthographic frustum are parallel to the view axis instead of going through the camera
+            sides = [((-1, 0, 0), right), ((1, 0, 0), -left), ((0, 1, 0), -bottom), ((0, -1, 0), top)]
+            for i, (normal, distance) in enumerate(sides):
+                planes[i] = plane(OpenMaya.MVector(*normal))
+                planes[i].distance = distance
+
         self.planes = planes
         self.numPlanes = 6
 
@@ -132,21 +304,85 @@ class frustum():
             return True  # Inside
         return True  # Intersect
 
+    def planesArray(self):
+        """Return the planes as a (6, 4) array of [normal.x, normal.y, normal.z, distance]"""
+        if not hasattr(self, '_planesArray'):
+            self._planesArray = numpy.array([[p.vector.x, p.vector.y, p.vector.z, p.distance] for p in self.planes])
+        return self._planesArray
+
+    def projectedCoverage(self, corners, width, height, pixelAspect=1.0):
+        """Return the approximate number of pixels covered by each box in a render of width x height.
+        Take a (N, 8, 4) array of corners in camera space, the frustum is fitted to the render aspect ratio with the film fit of the camera.
+        With a perspective camera a box crossing the near clip plane covers the whole image,
+        with an orthographic one the boxes are projected without the perspective divide.
+        """
+        left, right, bottom, top = viewingFrustum(self.camera, float(width) / height * pixelAspect)
+        if self.orthographic:
+            crossing = numpy.zeros(len(corners), dtype=bool)
+            x, y = corners[..., 0], corners[..., 1]
+        else:
+            depth = -corners[..., 2]
+            crossing = (depth <= self.nearClip).any(axis=1)
+            depth = numpy.maximum(depth, self.nearClip)
+            x, y = corners[..., 0] * self.nearClip / depth, corners[..., 1] * self.nearClip / depth
+        x = numpy.clip((2.0 * x - (right + left)) / (right - left), -1.0, 1.0)
+        y = numpy.clip((2.0 * y - (top + bottom)) / (top - bottom), -1.0, 1.0)
+        coverage = (x.max(axis=1) - x.min(axis=1)) * (y.max(axis=1) - y.min(axis=1)) / 4.0
+        coverage[crossing] = 1.0
+        return coverage * width * height
+
+    def camInvWorldArray(self):
+        if not hasattr(self, '_camInvWorldArray'):
+            self._camInvWorldArray = mmatrixToArray(self.camInvWorldMtx)
+        return self._camInvWorldArray
+
+    def classifyBoxes(self, corners):
+        """Batched version of relativeToFrustum.
+        Take a (N, 8, 4) array of corners in camera space and return OUTSIDE, INTERSECT or INSIDE for each box.
+        """
+        behind = numpy.dot(corners, self.planesArray().T) < 0.0  # (N, 8, 6)
+        outside = behind.all(axis=1).any(axis=1)  # all points were behind the same plane
+        inside = ~behind.any(axis=(1, 2))
+        relations = numpy.full(len(corners), INTERSECT, dtype=numpy.int8)
+        relations[inside] = INSIDE
+        relations[outside] = OUTSIDE
+        return relations
+
+
+class FrustumCache():
+    """Keep one frustum per camera, it is only rebuilt if the camera world matrix, focal length, film back or clip planes changed.
+    The signature of the camera is read at each call, even at the same time, so a camera edited between two scans of a frame is never stale.
+    """
+
+    def __init__(self):
+        self.frustums = {}
+
+    def get(self, cameraName, time=None, context=None):
+        """Pass a context (see timeContext) to get the frustum at another time than the current one, the context decides the time evaluated"""
+        cached = self.frustums.get(cameraName)
+        camDagPath = getDagPath(cameraName)
+        signature = cameraSignature(camDagPath, context)
+        if not cached or cached['signature'] != signature:
+            cached = {'frustum': frustum(cameraName, camDagPath, context), 'signature': signature}
+            self.frustums[cameraName] = cached
+        return cached['frustum']
+
+    def clear(self):
+        self.frustums.clear()
+
 
 class dkbObjectsInCameraView():
 
-    def __init__(self, cameraName, node):
-        selectionList = OpenMaya.MSelectionList()
-        camDagPath = OpenMaya.MDagPath()
-        selectionList.add(cameraName)
-        selectionList.getDagPath(0, camDagPath)
+    def __init__(self, cameraName, node, fnCam=None):
+        if fnCam is None:
+            fnCam = frustum(cameraName)
         self.cameraName = cameraName
-        self.cameraDagPath = OpenMaya.MFnCamera(camDagPath)
-        self.camInvWorldMtx = camDagPath.inclusiveMatrixInverse()
+        self.fnCam = fnCam
+        self.camInvWorldMtx = fnCam.camInvWorldMtx
         self.node = node
 
     def processNode(self):
-        fnCam = frustum(self.cameraName)
+        fnCam = self.fnCam
         points = []
 
         # for node in self.objectList:
@@ -184,15 +420,116 @@ class dkbObjectsInCameraView():
         return False
 
 
+class BoundsHierarchy():
+    """Tree of bounding boxes over the DAG, used to test whole groups against the frustum at once.
+    In 'dag' mode the tree follows the groups above the nodes, in 'reference' mode the nodes are gathered under the root of their reference.
+    A subtree outside the frustum is rejected and a subtree inside is accepted without testing its leaves,
+    only the boxes straddling the frustum are tested deeper.
+    """
+
+    def __init__(self, nodes, mode='dag'):
+        self.nodes = list(nodes)
+        self.mode = mode
+        self.roots = []
+        self.children = {}
+        self.members = {}  # Indices of the nodes sitting at that key of the tree
+        self.leaves = {}  # Indices of all the nodes in the subtree
+        self.dagPaths = {}
+        self._referenceNodes = {}
+        self._corners = {}
+        self._cornersTime = None
+        for index, node in enumerate(self.nodes):
+            path = getDagPath(node).fullPathName()
+            if mode == 'reference':
+                chain = self.referenceChain(path)
+            else:
+                chain = self.ancestors(path) + [path]
+            parent = None
+            for key in chain:
+                if key not in self.children:
+                    self.children[key] = []
+                    self.members[key] = []
+                    self.dagPaths[key] = getDagPath(key)
+                    (self.children[parent] if parent else self.roots).append(key)
+                parent = key
+            self.members[chain[-1]].append(index)
+        for root in self.roots:
+            self._gatherLeaves(root)
+
+    def ancestors(self, path):
+        """Return the full paths of the ancestors of a node, from the top of the hierarchy"""
+        return ['|'.join(path.split('|')[:i]) for i in xrange(2, path.count('|') + 1)]
+
+    def referenceChain(self, path):
+        if not cmds.referenceQuery(path, isNodeReferenced=True):
+            return [path]
+        refNode = cmds.referenceQuery(path, referenceNode=True)
+        if refNode not in self._referenceNodes:
+            self._referenceNodes[refNode] = set(cmds.ls(cmds.referenceQuery(refNode, nodes=True, dagPath=True), long=True))
+        for ancestor in self.ancestors(path):
+            if ancestor in self._referenceNodes[refNode]:
+                return [ancestor, path]
+        return [path]
+
+    def _gatherLeaves(self, key):
+        leaves = list(self.members[key])
+        for child in self.children[key]:
+            leaves.extend(self._gatherLeaves(child))
+        self.leaves[key] = numpy.array(leaves, dtype=int)
+        return leaves
+
+    def worldCorners(self, keys, time=None):
+        """Return the world corners of the boxes of the keys, they are read only once for a given time"""
+        if time is None or time != self._cornersTime:
+            self._corners = {}
+            self._cornersTime = time
+        missing = [key for key in keys if key not in self._corners]
+        if missing:
+            bounds, matrices = getLocalBounds([self.dagPaths[key] for key in missing])
+            self._corners.update(zip(missing, numpy.einsum('nkj,nji->nki', boxCorners(bounds), matrices)))
+        return numpy.array([self._corners[key] for key in keys])
+
+    def clear(self):
+        """Forget the boxes read, the nodes may have moved even if the time is the same"""
+        self._corners = {}
+        self._cornersTime = None
+
+    def cull(self, fnCam, mask=None, time=None):
+        """Return a boolean array telling for each node if it is in the frustum.
+        The optional mask restricts the test to some of the nodes, the others are returned as False.
+        Pass the current time so the boxes are read only once when several cameras are tested at the same time.
+        """
+        if mask is None:
+            mask = numpy.ones(len(self.nodes), dtype=bool)
+        result = numpy.zeros(len(self.nodes), dtype=bool)
+        frontier = [key for key in self.roots if mask[self.leaves[key]].any()]
+        while frontier:
+            corners = self.worldCorners(frontier, time)
+            relations = fnCam.classifyBoxes(numpy.dot(corners, fnCam.camInvWorldArray()))
+            nextFrontier = []
+            for key, relation in zip(frontier, relations):
+                if relation == INSIDE:
+                    result[self.leaves[key]] = True
+                elif relation == INTERSECT:
+                    result[self.members[key]] = True
+                    nextFrontier.extend(child for child in self.children[key] if mask[self.leaves[child]].any())
+            frontier = nextFrontier
+        return result & mask
+
+
+CULLED = 0
+PROXY = 1
+FULL = 2
 
 
-import libmaya
-import FrustrumScanner
-# Can be optimised even more by sorting meshes by references, and then by removing all meshes from that reference if only one has been detected.
-
 class FrustumScanner():
 
-    def __init__(self, cameras, nodes):
+    def __init__(self, cameras, nodes, hierarchy=None, splitStatic=False):
+        """The hierarchy argument can be set to 'dag' or 'reference' to reject/accept whole groups of nodes at once, see BoundsHierarchy.
+        With splitStatic the bounds of the nodes not animated are read only once per scan, only the animated ones are read again at each frame.
+        A node is static if nothing found by libmaya.getAnimatedNodes() drives it, a node moved by something else (a script, a cache read outside of the time) is then wrong.
+        """
+        self.nodes = list(nodes)
         self.cameras = {}
         for camera in cameras:
             shotrange = [1, 100]
@@ -200,19 +537,132 @@ class FrustumScanner():
                                     'outside': list(nodes),
                                     'range': shotrange
                                     }
+        self.frustums = FrustumCache()
+        self.timings = {'frames': {}, 'cameras': {}}
+        self.visibility = None  # VisibilityStore filled when the timeline is processed with history
+        self.hierarchy = None
+        if hierarchy and numpy is not None:
+            self.hierarchy = BoundsHierarchy(nodes, mode=hierarchy)
+            self.nodeIndex = dict((node, i) for i, node in enumerate(self.hierarchy.nodes))
+        self.resolver = libmaya.VisibilityResolver()
+        self.splitStatic = splitStatic and numpy is not None
+        self.animated = None
+        self._staticCorners = {}
+
+    def clearCaches(self):
+        """Forget everything read from the scene by the previous scan, done at the start of each scan"""
+        self.resolver.clear()
+        self.clearStatic()
+        if self.hierarchy:
+            self.hierarchy.clear()
+
+    def clearStatic(self):
+        """Forget the bounds of the static nodes and find the animated ones again, done at the start of each scan"""
+        self._staticCorners = {}
+        if self.splitStatic:
+            self.animated = set(libmaya.getAnimatedNodes(self.nodes))
+            logger.info('{} animated nodes out of {}'.format(len(self.animated), len(self.nodes)))
 
     def objectsInCameraView(self, camera):
-        # print 'test'
-        for obj in list(self.cameras[camera]['outside']):
-            if libmaya.isVisible(obj):
-                CHK = frustrum.dkbObjectsInCameraView(camera, obj)
+        self.clearCaches()
+        self._processFrame(cmds.currentTime(query=True), [camera])
+
+    def camerasAtFrame(self, frame):
+        return [camera for camera, values in self.cameras.iteritems() if values['range'][0] <= frame <= values['range'][1]]
+
+    def _processFrame(self, frame, cameras, candidates=None, corners=None, context=None):
+        """Test the nodes against all the cameras of a frame.
+        The bounds are read once for all the cameras, or given with their candidates when sampled by TimeSampler.
+        """
+        start = time.time()
+        if numpy is None:
+            candidates = []
+        elif candidates is None:
+            outside = self.nodes if self.visibility else set(libpython.flatten(self.cameras[camera]['outside'] for camera in cameras))
+            candidates = self.resolver.visibleNodes(outside, frame)
+            if candidates and not self.hierarchy:
+                corners = self.worldCorners(candidates)
+        index = dict((obj, i) for i, obj in enumerate(candidates))
+        for camera in cameras:
+            cameraStart = time.time()
+            if numpy is None:
+                self._objectsInCameraViewSingle(camera)
+            else:
+                nodes = candidates if self.visibility else [obj for obj in self.cameras[camera]['outside'] if obj in index]
+                inside = self._insideNodes(camera, frame, nodes, index, corners, context) if nodes else set()
+                if self.visibility:
+                    self.visibility.setVisible(camera, frame, inside)
+                self._moveInside(camera, inside)
+            self.timings['cameras'][camera] = self.timings['cameras'].get(camera, 0.0) + time.time() - cameraStart
+        self.timings['frames'][frame] = time.time() - start
+
+    def _insideNodes(self, camera, frame, nodes, index, corners=None, context=None):
+        """Return the nodes in the frustum of the camera, corners are indexed by index, or the hierarchy is used if they are None"""
+        fnCam = self.frustums.get(camera, frame, context)
+        if corners is None:
+            mask = numpy.zeros(len(self.hierarchy.nodes), dtype=bool)
+            mask[[self.nodeIndex[obj] for obj in nodes]] = True
+            return set(self.hierarchy.nodes[i] for i in numpy.flatnonzero(self.hierarchy.cull(fnCam, mask, frame)))
+        relations = fnCam.classifyBoxes(numpy.dot(corners[[index[obj] for obj in nodes]], fnCam.camInvWorldArray()))
+        return set(obj for obj, relation in zip(nodes, relations) if relation != OUTSIDE)
+
+    def _splitStatic(self, nodes):
+        """Return the indices of the static and animated nodes, the corners of the static ones are read once and cached"""
+        static = [i for i, obj in enumerate(nodes) if obj not in self.animated]
+        animated = [i for i, obj in enumerate(nodes) if obj in self.animated]
+        missing = [nodes[i] for i in static if nodes[i] not in self._staticCorners]
+        if missing:
+            self._staticCorners.update(zip(missing, getWorldCorners(missing)))
+        return static, animated
+
+    def worldCorners(self, nodes):
+        """Same as getWorldCorners, only the animated nodes are read again if the static ones are split"""
+        if self.animated is None:
+            return getWorldCorners(nodes)
+        static, animated = self._splitStatic(nodes)
+        corners = numpy.empty((len(nodes), 8, 4))
+        if static:
+            corners[static] = [self._staticCorners[nodes[i]] for i in static]
+        if animated:
+            corners[animated] = getWorldCorners([nodes[i] for i in animated])
+        return corners
+
+    def sampleCorners(self, nodes, frames):
+        """Same as TimeSampler.sample, only the animated nodes are sampled if the static ones are split"""
+        if self.animated is None:
+            return TimeSampler(nodes).sample(frames)
+        static, animated = self._splitStatic(nodes)
+        corners = numpy.empty((len(frames), len(nodes), 8, 4))
+        if static:
+            corners[:, static] = [self._staticCorners[nodes[i]] for i in static]
+        if animated:
+            corners[:, animated] = TimeSampler([nodes[i] for i in animated]).sample(frames)
+        return corners
+
+    def _moveInside(self, camera, inside):
+        self.cameras[camera]['inside'].extend(obj for obj in self.cameras[camera]['outside'] if obj in inside)
+        self.cameras[camera]['outside'] = [obj for obj in self.cameras[camera]['outside'] if obj not in inside]
+
+    def _objectsInCameraViewSingle(self, camera):
+        """Test the nodes one by one, used when numpy is not available"""
+        fnCam = self.frustums.get(camera)
+        inside = set()
+        for obj in self.cameras[camera]['outside']:
+            if self.resolver.isVisible(obj):
+                CHK = dkbObjectsInCameraView(camera, obj, fnCam)
                 if CHK.processNode():
-                    self.cameras[camera]['inside'].append(obj)
-                    self.cameras[camera]['outside'].remove(obj)
+                    inside.add(obj)
             else:
                 print 'not visible'
-
-    def processTimeline(self, begin=None, end=None, framePadding=1):
+        self._moveInside(camera, inside)
+
+    def processTimeline(self, begin=None, end=None, framePadding=1, useContext=False, chunkSize=10, history=False):
+        """Scan the frames between begin and end, the time is changed once per frame and the nodes are tested against all the cameras covering it.
+        With useContext the nodes and cameras are evaluated through a MDGContext instead of changing the current time,
+        chunkSize frames are sampled at once for each node, the visibility of the nodes is evaluated at each frame too.
+        With history every node is tested at every frame and the result is kept in self.visibility, a VisibilityStore.
+        The time spent on each frame and each camera is kept in self.timings.
+        """
         if begin is None:
             begin = cmds.playbackOptions(query=True, minTime=True)
         if end is None:
@@ -220,18 +670,172 @@ class FrustumScanner():
         begin = int(begin)
         end = int(end)
 
-        for frame in xrange(begin, end, framePadding):
-            for camera in self.cameras:
-                print self.cameras[camera]['range'][0], self.cameras[camera]['range'][1]
-                if self.cameras[camera]['range'][0] <= frame <= self.cameras[camera]['range'][1]:
-                    # Change the frame and scan only if needed
+        self.timings = {'frames': {}, 'cameras': {}}
+        self.clearCaches()
+        frames = [frame for frame in xrange(begin, end, framePadding) if self.camerasAtFrame(frame)]
+        self.visibility = None
+        if history and frames and numpy is not None:
+            self.visibility = visibility.VisibilityStore(self.nodes, frames[0], frames[-1])
+        if useContext and numpy is not None:
+            for i in xrange(0, len(frames), chunkSize):
+                self._processFramesContext(frames[i:i + chunkSize])
+        else:
+            with libmaya.bulkEditContext('processTimeline', evaluation=None):
+                for frame in frames:
                     cmds.currentTime(frame)
-                    self.objectsInCameraView(camera)
+                    self._processFrame(frame, self.camerasAtFrame(frame))
+        self.logTimings()
+
+    def _processFramesContext(self, frames):
+        cameras = set(libpython.flatten(self.camerasAtFrame(frame) for frame in frames))
+        outside = self.nodes if self.visibility else set(libpython.flatten(self.cameras[camera]['outside'] for camera in cameras))
+        contexts = [timeContext(frame) for frame in frames]
+        visible = [set(self.resolver.visibleNodes(outside, frame, context)) for frame, context in zip(frames, contexts)]
+        candidates = [obj for obj in outside if any(obj in nodes for nodes in visible)]
+        corners = self.sampleCorners(candidates, frames) if candidates else None
+        for f, frame in enumerate(frames):
+            # Only the nodes visible at the frame, their corners are taken from the ones sampled for the whole chunk
+            indices = [i for i, obj in enumerate(candidates) if obj in visible[f]]
+            frameCorners = corners[f][indices] if indices else None
+            self._processFrame(frame, self.camerasAtFrame(frame), [candidates[i] for i in indices], frameCorners, contexts[f])
+
+    def frameState(self, frame, useContext=False):
+        """Return the nodes inside each camera covering the frame, with the world matrix of the camera.
+        Unlike processTimeline every visible node is tested, not only the ones still outside.
+        """
+        start = time.time()
+        context = timeContext(frame) if useContext else None
+        if not useContext:
+            cmds.currentTime(frame)
+        candidates = self.resolver.visibleNodes(self.nodes, frame, context)
+        index = dict((obj, i) for i, obj in enumerate(candidates))
+        corners = None
+        if candidates and useContext:
+            corners = self.sampleCorners(candidates, [frame])[0]
+        elif candidates and not self.hierarchy:
+            corners = self.worldCorners(candidates)
+        state = {}
+        for camera in self.camerasAtFrame(frame):
+            inside = self._insideNodes(camera, frame, candidates, index, corners, context) if candidates else set()
+            camInvWorldMtx = self.frustums.get(camera, frame, context).camInvWorldMtx
+            state[camera] = (inside, camInvWorldMtx.inverse())
+        self.timings['frames'][frame] = time.time() - start
+        return state
+
+    def processTimelineAdaptive(self, begin=None, end=None, stride=8, maxGap=1, moveThreshold=None, turnThreshold=None, useContext=False):
+        """Scan the timeline every stride frames, then bisect the intervals where a node enters or leaves a camera,
+        or where a camera moves faster than moveThreshold (units per frame) or turns faster than turnThreshold (degrees per frame).
+        The bisection stops when the interval is not larger than maxGap.
+        The frames between two evaluated frames get the visibility of the previous one in self.visibility.
+        Return a report of the frames evaluated. No two evaluated frames are more than stride frames apart, that is the only guarantee:
+        a change seen between two coarse samples is located within maxGap frames, but a node entering and leaving a camera
+        between two coarse samples is never seen. Lower the stride for fast moving cameras or objects.
+        """
+        if numpy is None:
+            raise RuntimeError('numpy is needed for the adaptive scan')
+        if begin is None:
+            begin = cmds.playbackOptions(query=True, minTime=True)
+        if end is None:
+            end = cmds.playbackOptions(query=True, maxTime=True)
+        begin = int(begin)
+        end = int(end)
+        stride = max(1, stride)
+        maxGap = max(1, maxGap)
+
+        self.timings = {'frames': {}, 'cameras': {}}
+        self.clearCaches()
+        frames = range(begin, end)
+        if not frames:
+            return {}
+        coarse = frames[::stride]
+        if coarse[-1] != frames[-1]:
+            coarse.append(frames[-1])
+        states = {}
+        for frame in coarse:
+            states[frame] = self.frameState(frame, useContext)
+        intervals = list(libpython.pairwise(coarse))
+        while intervals:
+            a, b = intervals.pop()
+            if b - a <= maxGap or not self._hasChanged(states[a], states[b], b - a, moveThreshold, turnThreshold):
+                continue
+            middle = (a + b) // 2
+            states[middle] = self.frameState(middle, useContext)
+            intervals.extend([(a, middle), (middle, b)])
+
+        for camera in self.cameras:
+            inside = set(libpython.flatten(state[camera][0] for state in states.itervalues() if camera in state))
+            self._moveInside(camera, inside)
+        sampled = sorted(states)
+        self.visibility = visibility.VisibilityStore(self.nodes, frames[0], frames[-1])
+        for a, b in libpython.pairwise(sampled + [frames[-1] + 1]):
+            for camera, (inside, matrix) in states[a].iteritems():
+                self.visibility.setRange(camera, a, b - 1, inside)
+        report = {'frames': sampled,
+                  'evaluated': len(sampled),
+                  'total': len(frames),
+                  'maxGap': max([b - a for a, b in libpython.pairwise(sampled)] or [0]),
+                  'changeGap': maxGap}
+        logger.info('Evaluated {evaluated} frames out of {total}, largest gap {maxGap} frames, changes seen located within {changeGap} frames'.format(**report))
+        self.logTimings()
+        return report
+
+    def _hasChanged(self, stateA, stateB, span, moveThreshold=None, turnThreshold=None):
+        if set(stateA) != set(stateB):
+            return True
+        for camera in stateA:
+            insideA, matrixA = stateA[camera]
+            insideB, matrixB = stateB[camera]
+            if insideA != insideB:
+                return True
+            if moveThreshold is not None:
+                move = OpenMaya.MPoint() * matrixA - OpenMaya.MPoint() * matrixB
+                if move.length() / span > moveThreshold:
+                    return True
+            if turnThreshold is not None:
+                forward = OpenMaya.MVector(0, 0, -1)
+                angle = math.degrees((forward * matrixA).angle(forward * matrixB))
+                if angle / span > turnThreshold:
+                    return True
+        return False
+
+    def screenCoverage(self, camera, nodes=None, width=None, height=None, pixelAspect=None):
+        """Return the approximate number of pixels covered by the bounding box of each node at the current time, 0 if outside of the frustum.
+        The resolution of the render globals is used if none is given.
+        """
+        nodes = list(self.nodes if nodes is None else nodes)
+        if not nodes:
+            return numpy.zeros(0)
+        resolution = renderResolution()
+        width = width or resolution[0]
+        height = height or resolution[1]
+        pixelAspect = pixelAspect or resolution[2]
+        fnCam = self.frustums.get(camera)
+        corners = numpy.dot(getWorldCorners(nodes), fnCam.camInvWorldArray())
+        pixels = fnCam.projectedCoverage(corners, width, height, pixelAspect)
+        pixels[fnCam.classifyBoxes(corners) == OUTSIDE] = 0.0
+        return pixels
+
+    def lodTiers(self, camera, nodes=None, culledPixels=1.0, proxyPixels=4096.0, **resolution):
+        """Return a dictionary giving CULLED, PROXY or FULL for each node depending on the pixels it covers in the camera at the current time.
+        Nodes covering less than culledPixels are culled, less than proxyPixels can be replaced by a proxy.
+        """
+        nodes = list(self.nodes if nodes is None else nodes)
+        pixels = self.screenCoverage(camera, nodes, **resolution)
+        tiers = numpy.full(len(nodes), FULL, dtype=numpy.int8)
+        tiers[pixels < proxyPixels] = PROXY
+        tiers[pixels < culledPixels] = CULLED
+        return dict(zip(nodes, tiers.tolist()))
+
+    def logTimings(self):
+        frames = self.timings['frames']
+        if not frames:
+            return
+        logger.info('Scanned {} frames in {:.3f}s, {:.3f}s per frame'.format(len(frames), sum(frames.values()), sum(frames.values()) / len(frames)))
+        for camera, elapsed in sorted(self.timings['cameras'].iteritems()):
+            logger.info('{}: {:.3f}s'.format(camera, elapsed))
+        for frame, elapsed in sorted(frames.iteritems()):
+            logger.debug('Frame {}: {:.3f}s'.format(frame, elapsed))
 
     def processCurrentFrame(self):
         current = cmds.currentTime(query=True)
         self.processTimeline(current, current + 1)
-
-
-
-
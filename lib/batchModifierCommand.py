@@ -0,0 +1,45 @@
+"""
+Plugin command applying the modifier of a libmaya.BatchModifier, so the whole batch is a single entry in the undo queue of Maya.
+It is loaded by BatchModifier.doIt(), there is no need to load it by hand.
+"""
+
+import maya.OpenMaya as OpenMaya
+import maya.OpenMayaMPx as OpenMayaMPx
+import lib.libmaya as libmaya
+
+COMMAND = 'applyBatchModifier'
+
+
+class ApplyBatchModifier(OpenMayaMPx.MPxCommand):
+
+    def __init__(self):
+        OpenMayaMPx.MPxCommand.__init__(self)
+        self.modifier = None
+
+    def isUndoable(self):
+        return self.modifier is not None
+
+    def doIt(self, args):
+        self.modifier, libmaya.BatchModifier.pending = libmaya.BatchModifier.pending, None
+        if self.modifier is None:
+            OpenMayaMPx.MPxCommand.displayError('No BatchModifier to apply, use BatchModifier.doIt()')
+            return
+        self.redoIt()
+
+    def redoIt(self):
+        self.modifier.doIt()
+
+    def undoIt(self):
+        self.modifier.undoIt()
+
+
+def creator():
+    return OpenMayaMPx.asMPxPtr(ApplyBatchModifier())
+
+
+def initializePlugin(mobject):
+    OpenMayaMPx.MFnPlugin(mobject, 'regnareb', '1.0').registerCommand(COMMAND, creator)
+
+
+def uninitializePlugin(mobject):
+    OpenMayaMPx.MFnPlugin(mobject).deregisterCommand(COMMAND)
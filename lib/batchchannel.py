@@ -0,0 +1,127 @@
+"""
+Progress and result channels from a job running in a Mayabatch process back to the Maya that launched it.
+
+The job calls reportProgress() with any json data, usually a percent and a message:
+reportProgress(percent=50, message='lambert1 1002 baked', udim=1002, time=12.3)
+
+Every call writes one json line on the file descriptor given in the MAYABATCH_PROGRESS_FD environment variable,
+or on the stream set with setStream() by a pool worker. Outside of a Mayabatch it does nothing, so the jobs can call it unconditionally.
+
+The value returned by the executeMayabatch() of the job is written with the timers in a json file next to the pickle,
+Mayabatch reads it instead of parsing the last lines printed by the process.
+
+A job made of several units of work records each unit done in a checkpoint file next to the pickle, when Mayabatch retries after a crash
+only the units not done yet are executed again:
+checkpoint = getCheckpoint()
+for unit in units:
+    if not checkpoint.isDone(unit):
+        checkpoint.complete(unit, bake(unit))
+return checkpoint.results(units)
+"""
+
+import os
+import json
+import time
+import lib.libpython as libpython
+
+ENVIRONMENT = 'MAYABATCH_PROGRESS_FD'
+stream = None
+currentPickle = None
+
+
+def setStream(newStream):
+    global stream
+    stream = newStream
+
+
+def getStream():
+    global stream
+    if stream is None and os.environ.get(ENVIRONMENT):
+        try:
+            stream = os.fdopen(int(os.environ[ENVIRONMENT]), 'w')
+        except (OSError, ValueError):
+            os.environ.pop(ENVIRONMENT)
+    return stream
+
+
+def reportProgress(**data):
+    output = getStream()
+    if output is None:
+        return
+    data.setdefault('timestamp', time.time())
+    output.write(json.dumps({'progress': data}) + '\n')
+    output.flush()
+
+
+def resultPath(pathPickle):
+    return libpython.replaceExtension(pathPickle, '.result.json')
+
+
+def writeResult(pathPickle, result, **timers):
+    libpython.jsonWrite(dict(timers, result=result), resultPath(pathPickle), default=repr)
+
+
+def readResult(pathPickle):
+    """Return the result written by the job and remove the file, None if there is none"""
+    path = resultPath(pathPickle)
+    try:
+        data = libpython.jsonLoad(path)
+        os.remove(path)
+    except (IOError, OSError, ValueError):
+        return None
+    return data
+
+
+def setJob(pathPickle):
+    """Set the job being executed, called before executing it so getCheckpoint() uses its checkpoint file"""
+    global currentPickle
+    currentPickle = pathPickle
+
+
+def checkpointPath(pathPickle):
+    return libpython.replaceExtension(pathPickle, '.checkpoint.json')
+
+
+def clearCheckpoint(pathPickle):
+    try:
+        os.remove(checkpointPath(pathPickle))
+    except OSError:
+        pass
+
+
+class Checkpoint(object):
+    """The units of work done by a job with their result, saved after each unit if there is a path.
+    A unit can be anything that can be converted to json, like a [shader, udim] list.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.done = {}
+        if path and os.path.exists(path):
+            try:
+                self.done = libpython.jsonLoad(path)
+            except ValueError:
+                pass
+
+    @staticmethod
+    def key(unit):
+        return json.dumps(unit, sort_keys=True)
+
+    def isDone(self, unit):
+        return self.key(unit) in self.done
+
+    def complete(self, unit, result=None):
+        self.done[self.key(unit)] = result
+        if self.path:
+            temporary = self.path + '.tmp'
+            libpython.jsonWrite(self.done, temporary, default=repr)
+            os.rename(temporary, self.path)  # Never leave a half written checkpoint if the process crashes
+
+    def results(self, units):
+        """Return the results of the units done, in the order of the units"""
+        return [self.done[self.key(unit)] for unit in units if self.isDone(unit)]
+
+
+def getCheckpoint():
+    """Return the checkpoint of the job being executed, an empty one that is not saved outside of a Mayabatch"""
+    return Checkpoint(checkpointPath(currentPickle) if currentPickle else None)
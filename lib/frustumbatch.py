@@ -0,0 +1,191 @@
+"""
+Scan the visibility of nodes for a whole sequence in parallel, with several maya -batch processes.
+
+The frame range (or the list of cameras) is split in chunks, each chunk being a FrustumScanJob sent to its own Mayabatch.
+Every worker opens the saved scene once, scans its frames with the FrustumScanner and writes the nodes visible at each frame in a json file.
+The results of all the workers are then merged into one.
+
+scanner = ParallelFrustumScanner({'shotCam1': [1, 120], 'shotCam2': [121, 200]}, cmds.ls(type='mesh', long=True), workers=4)
+scanner.process()
+scanner.visibility['shotCam1'][12]  # Nodes visible at frame 12
+scanner.store.save('/path/visibility.json')  # See lib.visibility
+
+The launcher argument replaces Mayabatch, StubWorker runs the jobs in threads of the current process.
+It lets you check the scheduling and the merging without Maya, with FakeScanJob faking the scan:
+scanner = ParallelFrustumScanner({'cam1': [1, 50]}, ['a', 'b', 'c'], workers=4, launcher=StubWorker, jobClass=FakeScanJob)
+scanner.process() == FakeScanJob({'cam1': [1, 50]}, ['a', 'b', 'c'], range(1, 51)).scan()  # Same as a single job
+"""
+
+import os
+import uuid
+import pickle
+import logging
+import tempfile
+import threading
+import lib.libpython as libpython
+logger = logging.getLogger(__name__)
+
+
+def splitFrames(frames, chunks):
+    """Split a list of frames in contiguous chunks of the same size, so each worker evaluates neighbouring frames"""
+    chunks = max(1, min(chunks, len(frames)))
+    size, extra = divmod(len(frames), chunks)
+    result = []
+    start = 0
+    for i in xrange(chunks):
+        end = start + size + (1 if i < extra else 0)
+        result.append(frames[start:end])
+        start = end
+    return [chunk for chunk in result if chunk]
+
+
+def splitCameras(cameras, chunks):
+    """Split a dictionary of cameras and their range, trying to give the same number of frames to each chunk"""
+    result = [{} for i in xrange(max(1, min(chunks, len(cameras))))]
+    load = [0] * len(result)
+    for camera, shotrange in sorted(cameras.iteritems(), key=lambda x: x[1][1] - x[1][0], reverse=True):
+        i = load.index(min(load))
+        result[i][camera] = shotrange
+        load[i] += shotrange[1] - shotrange[0] + 1
+    return result
+
+
+def mergeResults(results):
+    """Merge the visibility of several jobs: {camera: {frame: [nodes]}}"""
+    merged = {}
+    for result in results:
+        for camera, frames in result.iteritems():
+            for frame, nodes in frames.iteritems():
+                merged.setdefault(camera, {}).setdefault(int(frame), set()).update(nodes)
+    for camera in merged:
+        for frame in merged[camera]:
+            merged[camera][frame] = sorted(merged[camera][frame])
+    return merged
+
+
+class FrustumScanJob(object):
+    """The chunk of work sent to a worker, it is pickled by Mayabatch and executed in the maya -batch process"""
+
+    def __init__(self, cameras, nodes, frames, hierarchy=None, useContext=False):
+        self.cameras = cameras
+        self.nodes = nodes
+        self.frames = frames
+        self.hierarchy = hierarchy
+        self.useContext = useContext
+        self.resultPath = libpython.formatPath('frustumscan.json', tempfile.gettempdir(), suffix=uuid.uuid4().hex)
+
+    def scan(self):
+        import lib.FrustumScanner as FrustumScanner
+        scanner = FrustumScanner.FrustumScanner(self.cameras.keys(), self.nodes, hierarchy=self.hierarchy)
+        for camera, shotrange in self.cameras.iteritems():
+            scanner.cameras[camera]['range'] = list(shotrange)
+        result = dict((camera, {}) for camera in self.cameras)
+        for frame in self.frames:
+            for camera, (inside, matrix) in scanner.frameState(frame, self.useContext).iteritems():
+                result[camera][frame] = sorted(inside)
+        return result
+
+    def executeMayabatch(self):
+        """The visibility goes in the json file of the job, the summary returned comes back through the result of Mayabatch"""
+        result = self.scan()
+        libpython.jsonWrite(result, self.resultPath)
+        return '{} frames scanned'.format(len(self.frames))
+
+    def loadResult(self):
+        result = libpython.jsonLoad(self.resultPath)
+        os.remove(self.resultPath)
+        return result
+
+
+class FakeScanJob(FrustumScanJob):
+    """Scan without Maya: the node visible by a camera at a frame only depends on the frame and the camera, whatever the worker"""
+
+    def scan(self):
+        result = dict((camera, {}) for camera in self.cameras)
+        for camera, shotrange in self.cameras.iteritems():
+            offset = sum(ord(i) for i in camera)  # The same for the camera in every job
+            for frame in self.frames:
+                if self.nodes and shotrange[0] <= frame <= shotrange[1]:
+                    result[camera][frame] = [self.nodes[(frame + offset) % len(self.nodes)]]
+        return result
+
+
+class StubWorker(threading.Thread):
+    """Stand-in for Mayabatch running the job in a thread of the current process.
+    The job goes through pickle like it would with a real worker.
+    """
+
+    def __init__(self, objectRecorded='', block=False, **kwargs):
+        super(StubWorker, self).__init__()
+        self.objectRecorded = pickle.loads(pickle.dumps(objectRecorded))
+        self.exitcode = None
+        self.start()
+        if block: self.join()
+
+    def run(self):
+        try:
+            self.objectRecorded.executeMayabatch()
+            self.exitcode = 0
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            self.exitcode = 1
+
+
+class ParallelFrustumScanner(object):
+
+    def __init__(self, cameras, nodes, workers=4, split='frames', hierarchy=None, useContext=False, launcher=None, jobClass=FrustumScanJob):
+        """cameras is a dictionary of the cameras and their [begin, end] range.
+        split can be 'frames' to split the frame range between the workers, or 'cameras' to give each worker its own cameras.
+        """
+        self.cameras = cameras
+        self.nodes = list(nodes)
+        self.workers = workers
+        self.split = split
+        self.hierarchy = hierarchy
+        self.useContext = useContext
+        self.launcher = launcher
+        self.jobClass = jobClass
+        self.visibility = {}
+        self.store = None
+        self.failed = []
+
+    def createJobs(self):
+        if self.split == 'cameras':
+            jobs = []
+            for cameras in splitCameras(self.cameras, self.workers):
+                frames = sorted(set(libpython.flatten(range(int(r[0]), int(r[1]) + 1) for r in cameras.values())))
+                jobs.append(self.jobClass(cameras, self.nodes, frames, self.hierarchy, self.useContext))
+            return jobs
+        frames = sorted(set(libpython.flatten(range(int(r[0]), int(r[1]) + 1) for r in self.cameras.values())))
+        return [self.jobClass(self.cameras, self.nodes, chunk, self.hierarchy, self.useContext) for chunk in splitFrames(frames, self.workers)]
+
+    def getLauncher(self):
+        if self.launcher is None:
+            import lib.mayabatch as mayabatch
+            self.launcher = mayabatch.Mayabatch
+        return self.launcher
+
+    def process(self):
+        """Launch one worker per job, wait for all of them and merge their results"""
+        launcher = self.getLauncher()
+        jobs = self.createJobs()
+        running = [(job, launcher(objectRecorded=job, exportList=False)) for job in jobs]
+        results = []
+        self.failed = []
+        for job, worker in running:
+            worker.join()
+            try:
+                if worker.exitcode:
+                    raise IOError('The worker crashed')
+                results.append(job.loadResult())
+            except (IOError, OSError, ValueError) as e:
+                logger.error('Frames {}-{} failed: {}'.format(job.frames[0], job.frames[-1], e))
+                self.failed.append(job)
+        self.visibility = mergeResults(results)
+        import lib.visibility as visibility
+        self.store = visibility.VisibilityStore.fromDict(self.visibility, self.nodes)
+        return self.visibility
+
+    def inside(self, camera):
+        """Return every node visible at least once by the camera"""
+        return sorted(set(libpython.flatten(self.visibility.get(camera, {}).values())))
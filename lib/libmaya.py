@@ -1,11 +1,14 @@
 import os
 import re
+import sys
 import time
 import logging
 import functools
 import contextlib
+import collections
 import maya.mel as mel
 import maya.cmds as cmds
+import maya.OpenMaya as OpenMaya
 import libpython
 logger = logging.getLogger(__name__)
 
@@ -15,12 +18,57 @@ logger = logging.getLogger(__name__)
 # cmds.getAttr('node.attribute')  # If several nodes have the same name, it will return a list instead of only one element or  crashing
 
 
-def getNewNodesCreated(_function):
-    """ Return the new nodes created after the execution of a function """
-    before = cmds.ls(long=True)
-    eval(_function)
-    after = cmds.ls(long=True)
-    return list(set(after) - set(before))
+def getNewNodesCreated(function, *args, **kwargs):
+    """ Return the new nodes created by the execution of a function """
+    with NewNodesContext() as context:
+        function(*args, **kwargs)
+    return context.created
+
+
+def nameOfMObject(mobject):
+    if mobject.hasFn(OpenMaya.MFn.kDagNode):
+        return OpenMaya.MFnDagNode(mobject).fullPathName()
+    return OpenMaya.MFnDependencyNode(mobject).name()
+
+
+class NewNodesContext(object):
+    """Track the nodes created and deleted in the block with MDGMessage callbacks, only the nodes concerned are visited.
+    The names are resolved at the exit of the block, the nodes created then deleted in the block are in neither list.
+    """
+    def __init__(self, nodeType='dependNode'):
+        self.nodeType = nodeType
+        self.created = []
+        self.deleted = []
+        self._added = collections.OrderedDict()
+        self._callbacks = []
+
+    def _nodeAdded(self, mobject, *args):
+        handle = OpenMaya.MObjectHandle(mobject)
+        self._added.setdefault(handle.hashCode(), []).append(handle)
+
+    def _nodeRemoved(self, mobject, *args):
+        """The hash codes are not unique, the node is compared with the handles of its bucket"""
+        bucket = self._added.get(OpenMaya.MObjectHandle(mobject).hashCode(), [])
+        for handle in bucket:
+            if handle.isValid() and handle.object() == mobject:
+                bucket.remove(handle)
+                return
+        self.deleted.append(nameOfMObject(mobject))
+
+    def __enter__(self):
+        self._callbacks.append(OpenMaya.MDGMessage.addNodeAddedCallback(self._nodeAdded, self.nodeType))
+        self._callbacks.append(OpenMaya.MDGMessage.addNodeRemovedCallback(self._nodeRemoved, self.nodeType))
+        return self
+
+    def __exit__(self, *exc_info):
+        for callback in self._callbacks:
+            OpenMaya.MMessage.removeCallback(callback)
+        self._callbacks = []
+        self.created = [nameOfMObject(handle.object()) for bucket in self._added.itervalues() for handle in bucket if handle.isValid()]
+
+# with NewNodesContext() as context:
+#     ... your code here....
+# print context.created, context.deleted
 
 
 def getShaders(listMeshes):
@@ -146,15 +194,74 @@ def getFirstSelection(filterNb=None, longName=False):
     return libpython.getFirstItem(selection, '')
 
 
+def getPlug(nodeattr):
+    selection = OpenMaya.MSelectionList()
+    selection.add(nodeattr)
+    plug = OpenMaya.MPlug()
+    selection.getPlug(0, plug)
+    return plug
+
+
+def isPlugDestination(plug):
+    """Return True if the plug or one of its children is connected as destination"""
+    if plug.isDestination():
+        return True
+    return plug.isCompound() and any(isPlugDestination(plug.child(i)) for i in xrange(plug.numChildren()))
+
+
+def getUsedMultiIndices(nodeattr):
+    """Return the logical indices of a multi attribute connected as destination, read from the existing indices only"""
+    plug = getPlug(nodeattr)
+    indices = OpenMaya.MIntArray()
+    plug.getExistingArrayAttributeIndices(indices)
+    return set(i for i in indices if isPlugDestination(plug.elementByLogicalIndex(i)))
+
+
 def getNextFreeMultiIndex(nodeattr, start=0, max=10000000):
     """Get the next available index, usefull for indexMatters(True) nodes like the plusMinusAverage."""
+    used = getUsedMultiIndices(nodeattr)
     for i in xrange(start, max):
-        con = cmds.connectionInfo(nodeattr + "[{}]".format(i), sourceFromDestination=True)
-        if not con:
+        if i not in used:
             return i
     return None
 
 
+class MultiIndexAllocator(object):
+    """Hand out free logical indices of multi attributes. The used indices of a node attribute are read once,
+    then the indices handed out are remembered so that several allocations done before connecting never overlap.
+    Call release() for the indices not connected in the end, or refresh() if the connections were changed elsewhere.
+    """
+    def __init__(self):
+        self.used = {}
+
+    def allocate(self, nodeattr, count=1, start=0):
+        """Return a list of count free indices starting from start"""
+        if nodeattr not in self.used:
+            self.used[nodeattr] = getUsedMultiIndices(nodeattr)
+        used = self.used[nodeattr]
+        indices = []
+        i = start
+        while len(indices) < count:
+            if i not in used:
+                indices.append(i)
+                used.add(i)
+            i += 1
+        return indices
+
+    def release(self, nodeattr, indices):
+        self.used.get(nodeattr, set()).difference_update(indices)
+
+    def refresh(self, nodeattr=None):
+        if nodeattr is None:
+            self.used.clear()
+        else:
+            self.used.pop(nodeattr, None)
+
+# allocator = MultiIndexAllocator()
+# for source, i in zip(sources, allocator.allocate('plusMinusAverage1.input1D', len(sources))):
+#     cmds.connectAttr(source, 'plusMinusAverage1.input1D[{}]'.format(i))
+
+
 def isVisible(node):
     """Traverse all and parent hierarchy to determine if a node is visible or not. It does not take into account animation keys
     To check if an intermediate object is visible you need to pass the shape as argument.
@@ -175,6 +282,64 @@ def isVisible(node):
     return visible
 
 
+class VisibilityResolver(object):
+    """Resolve the visibility of all the DAG nodes of the scene in a single walk of the DAG, the parents are visited before their children.
+    The visibility, intermediateObject and overrideVisibility of the parents are propagated top-down, the hierarchy of an invisible node is not visited.
+    The result is cached per frame, up to cacheSize frames.
+    """
+
+    def __init__(self, cacheSize=10):
+        self.cacheSize = cacheSize
+        self.cache = collections.OrderedDict()
+        self.longNames = {}
+
+    def resolve(self, context=None):
+        """Return a dict {long name: True} of the visible DAG nodes, read through the MDGContext if passed"""
+        context = context or OpenMaya.MDGContext()
+        visible = {'': True}
+        fnDag = OpenMaya.MFnDagNode()
+        iterator = OpenMaya.MItDag(OpenMaya.MItDag.kDepthFirst)
+        iterator.next()  # Skip the world node
+        while not iterator.isDone():
+            path = OpenMaya.MDagPath()
+            iterator.getPath(path)
+            name = path.fullPathName()
+            if name.rpartition('|')[0] not in visible:
+                iterator.prune()
+                iterator.next()
+                continue
+            fnDag.setObject(path)
+            if fnDag.findPlug('visibility').asBool(context) and not fnDag.findPlug('intermediateObject').asBool(context):
+                if not fnDag.findPlug('overrideEnabled').asBool(context) or fnDag.findPlug('overrideVisibility').asBool(context):
+                    visible[name] = True
+            iterator.next()
+        del visible['']
+        return visible
+
+    def get(self, frame=None, context=None):
+        """Return the visible nodes at the frame, the current time if None"""
+        if frame is None:
+            frame = cmds.currentTime(query=True)
+        if frame not in self.cache:
+            self.cache[frame] = self.resolve(context)
+            if len(self.cache) > self.cacheSize:
+                self.cache.popitem(last=False)
+        return self.cache[frame]
+
+    def isVisible(self, node, frame=None, context=None):
+        if node not in self.longNames:
+            self.longNames[node] = longNameOf(node)
+        return self.longNames[node] in self.get(frame, context)
+
+    def visibleNodes(self, nodes, frame=None, context=None):
+        """Return the visible nodes among the ones passed, in the same order"""
+        return [node for node in nodes if self.isVisible(node, frame, context)]
+
+    def clear(self):
+        self.cache.clear()
+        self.longNames.clear()
+
+
 def parent(parent, child, *args, **kwargs):
     """Prevent the RuntimeError when it's already a parent to the child, or trying to parent a referenced node"""
     try:
@@ -271,12 +436,185 @@ def getAllAscendantConnections(nodes):
     ancestors = set()
     while nodes:
         ancestors.update(nodes)
-        parents = cmds.listConnections(nodes, source=False)
+        parents = cmds.listConnections(nodes, source=False) or []
         nodes = list(set(parents) - ancestors)
     return list(ancestors)
 
 
-def getReferencesConnections(refNodes=[]):
+ANIMATION_SOURCES = ['animCurveTL', 'animCurveTA', 'animCurveTT', 'animCurveTU', 'constraint', 'expression', 'time']
+
+
+def getAnimatedNodes(nodes):
+    """Return the nodes that can move: driven by animation curves, constraints, expressions or the time,
+    through their parents, or through their shapes and children like a skinned or blendshaped mesh or a group with moving children.
+    The connections are walked from all the animation sources of the scene, then again from the DAG nodes under the driven ones until nothing new is found.
+    """
+    sources = cmds.ls(type=ANIMATION_SOURCES)
+    driven = set(cmds.ls(getAllAscendantConnections(sources), long=True)) if sources else set()
+    while driven:
+        # The children of a driven node move with it, and drive in turn what is connected to them
+        new = set(cmds.ls(list(driven), dag=True, long=True)) - driven
+        if not new:
+            break
+        driven.update(cmds.ls(getAllAscendantConnections(list(new)), long=True))
+    parents = set()
+    for path in driven:
+        parts = path.split('|')
+        parents.update('|'.join(parts[:i]) for i in xrange(2, len(parts)))
+    animated = []
+    for node in nodes:
+        path = longNameOf(node)
+        if path in driven or path in parents:
+            animated.append(node)
+    return animated
+
+
+class ConnectionGraph(object):
+    """Snapshot of the dependency graph built in one pass over all the nodes, each node has an id with its upstream and downstream ids.
+    The names are resolved only for the results of the queries so renaming nodes does not invalidate it.
+    With track the connection callbacks keep it up to date, call untrack() once done. The references owning the nodes are not updated,
+    call build() again after loading or unloading references.
+    """
+    def __init__(self, track=False):
+        self._callbacks = []
+        self.build()
+        if track:
+            self.track()
+
+    def build(self):
+        self.handles = []
+        self.ids = {}
+        self.upstream = []
+        self.downstream = []
+        self.edges = collections.defaultdict(int)
+        self.references = {}
+        fnNode = OpenMaya.MFnDependencyNode()
+        plugs = OpenMaya.MPlugArray()
+        sources = OpenMaya.MPlugArray()
+        iterator = OpenMaya.MItDependencyNodes()
+        while not iterator.isDone():
+            mobject = iterator.thisNode()
+            nodeId = self._id(mobject)
+            fnNode.setObject(mobject)
+            fnNode.getConnections(plugs)
+            for i in xrange(plugs.length()):
+                plugs[i].connectedTo(sources, True, False)
+                for j in xrange(sources.length()):
+                    self._connect(self._id(sources[j].node()), nodeId)
+            iterator.next()
+        self._buildReferences()
+
+    def _buildReferences(self):
+        """The nodes of nested references are owned by the innermost reference, the one with the fewest nodes"""
+        owned = []
+        for refNode in cmds.ls(type='reference'):
+            try:
+                nodes = cmds.referenceQuery(refNode, nodes=True, dagPath=True) or []
+            except RuntimeError:  # sharedReferenceNode and unknown references
+                continue
+            owned.append((len(nodes), refNode, nodes))
+        for _, refNode, nodes in sorted(owned, reverse=True):
+            for nodeId in self.idsOf(nodes):
+                self.references[nodeId] = refNode
+
+    def _find(self, mobject):
+        """Return the id of the node, None if it is not in the graph.
+        The hash codes are not unique and the memory of a deleted node can be reused, the handles of a bucket are compared.
+        """
+        for nodeId in self.ids.get(OpenMaya.MObjectHandle(mobject).hashCode(), []):
+            handle = self.handles[nodeId]
+            if handle.isValid() and handle.object() == mobject:
+                return nodeId
+        return None
+
+    def _id(self, mobject):
+        nodeId = self._find(mobject)
+        if nodeId is None:
+            handle = OpenMaya.MObjectHandle(mobject)
+            nodeId = len(self.handles)
+            self.ids.setdefault(handle.hashCode(), []).append(nodeId)
+            self.handles.append(handle)
+            self.upstream.append(set())
+            self.downstream.append(set())
+        return nodeId
+
+    def _connect(self, source, destination):
+        self.edges[(source, destination)] += 1
+        self.upstream[destination].add(source)
+        self.downstream[source].add(destination)
+
+    def _disconnect(self, source, destination):
+        self.edges[(source, destination)] -= 1
+        if self.edges[(source, destination)] <= 0:
+            del self.edges[(source, destination)]
+            self.upstream[destination].discard(source)
+            self.downstream[source].discard(destination)
+
+    def _connectionChanged(self, sourcePlug, destinationPlug, made, *args):
+        source = self._id(sourcePlug.node())
+        destination = self._id(destinationPlug.node())
+        if made:
+            self._connect(source, destination)
+        else:
+            self._disconnect(source, destination)
+
+    def track(self):
+        if not self._callbacks:
+            self._callbacks.append(OpenMaya.MDGMessage.addConnectionCallback(self._connectionChanged))
+
+    def untrack(self):
+        for callback in self._callbacks:
+            OpenMaya.MMessage.removeCallback(callback)
+        self._callbacks = []
+
+    def idsOf(self, nodes):
+        """Return the ids of the nodes, the ones not in the graph are ignored"""
+        ids = []
+        selection = OpenMaya.MSelectionList()
+        mobject = OpenMaya.MObject()
+        for node in nodes:
+            selection.clear()
+            try:
+                selection.add(node)
+            except RuntimeError:
+                continue
+            selection.getDependNode(0, mobject)
+            nodeId = self._find(mobject)
+            if nodeId is not None:
+                ids.append(nodeId)
+        return ids
+
+    def namesOf(self, ids):
+        return [nameOfMObject(self.handles[i].object()) for i in ids if self.handles[i].isValid()]
+
+    def closure(self, ids, adjacency):
+        """Return the ids reachable from the ones passed, themselves included"""
+        visited = set(ids)
+        queue = collections.deque(visited)
+        while queue:
+            for nextId in adjacency[queue.popleft()]:
+                if nextId not in visited:
+                    visited.add(nextId)
+                    queue.append(nextId)
+        return visited
+
+    def descendants(self, nodes):
+        """Return the nodes connected downstream of the nodes, like getAllAscendantConnections"""
+        return self.namesOf(self.closure(self.idsOf(nodes), self.downstream))
+
+    def ancestors(self, nodes):
+        """Return the nodes connected upstream of the nodes"""
+        return self.namesOf(self.closure(self.idsOf(nodes), self.upstream))
+
+    def referenceOf(self, node):
+        """Return the reference node owning the node, None if it is not referenced"""
+        nodeId = libpython.getFirstItem(self.idsOf([node]))
+        return self.references.get(nodeId)
+
+
+def getReferencesConnections(refNodes=[], graph=None):
+    """Return a dict {refNode: [refNodes]} of the references whose transforms are driven by the curves of the reference"""
+    graph = graph or ConnectionGraph()
     result = {}
     refs = getReferences(nodesInRef=True)
     for i in refs.values():
@@ -284,15 +622,12 @@ def getReferencesConnections(refNodes=[]):
             continue
         curves = cmds.ls(i['nodesInRef'], type='nurbsCurve', long=True)
         curves = getTransforms(curves)
-        try:
-            parents = getAllAscendantConnections(curves)
-            parents = cmds.ls(parents, type='transform', long=True)
-            parents = [u for u in parents if cmds.referenceQuery(u, isNodeReferenced=True)]
-            for parent in parents:
-                if i['refNode'] != cmds.referenceQuery(parent, referenceNode=True):
-                    result.setdefault(i['refNode'], set()).add(cmds.referenceQuery(parent, referenceNode=True))
-        except TypeError:
-            pass
+        if not curves:
+            continue
+        for parent in cmds.ls(graph.descendants(curves), type='transform', long=True):
+            refNode = graph.referenceOf(parent)
+            if refNode and refNode != i['refNode']:
+                result.setdefault(i['refNode'], set()).add(refNode)
     for i in result:
         result[i] = list(result[i])
 
@@ -327,6 +662,70 @@ def getShaderAssignation(shader):
     return []
 
 
+class ShadingIndex(object):
+    """Shading assignments of the whole scene read in one pass over the shadingEngines, one cmds.sets query each.
+    shapes: {shape: [(shadingEngine, material, ranges)]} with ranges a list of (first, last) faces, both included, or None for the whole shape
+    members: {material: [members]} as returned by getShaderAssignation
+    shapesByMaterial: {material: set of shapes}
+    The shapes are long names, the transforms of the members are resolved once per node.
+    """
+    FACES = re.compile(r'^f\[(\d+)(?::(\d+))?\]$')
+
+    def __init__(self):
+        self.build()
+
+    def build(self):
+        self.shapes = {}
+        self.members = {}
+        self.materials = {}
+        self.shadingEngines = {}
+        self.shapesByMaterial = {}
+        self._shapesOf = {}
+        for shadingEngine in cmds.ls(type='shadingEngine'):
+            material = getMaterialFromSG(shadingEngine)
+            self.materials[shadingEngine] = material
+            self.shadingEngines.setdefault(material, []).append(shadingEngine)
+            members = cmds.sets(shadingEngine, query=True) or []
+            self.members.setdefault(material, []).extend(members)
+            ranges = {}
+            for member in members:
+                node, _, component = member.partition('.')
+                match = self.FACES.match(component)
+                for shape in self.shapesOf(node):
+                    if not component:
+                        ranges[shape] = None
+                    elif match and ranges.get(shape, []) is not None:
+                        first, last = match.groups()
+                        ranges.setdefault(shape, []).append((int(first), int(last or first)))
+            for shape, faces in ranges.iteritems():
+                self.shapes.setdefault(shape, []).append((shadingEngine, material, faces))
+                self.shapesByMaterial.setdefault(material, set()).add(shape)
+
+    def shapesOf(self, node):
+        """Return the long names of the shapes of a node, the node itself if it is a shape"""
+        if node not in self._shapesOf:
+            self._shapesOf[node] = cmds.ls(node, shapes=True, long=True) or cmds.listRelatives(node, shapes=True, noIntermediate=True, fullPath=True) or []
+        return self._shapesOf[node]
+
+    def assignments(self, nodes):
+        """Return the list of (shadingEngine, material, ranges) of the shapes or transforms"""
+        return [assignment for node in nodes for shape in self.shapesOf(node) for assignment in self.shapes.get(shape, [])]
+
+    def shadingEnginesOf(self, nodes):
+        return sorted(set(assignment[0] for assignment in self.assignments(nodes)))
+
+    def materialsOf(self, nodes):
+        return sorted(set(assignment[1] for assignment in self.assignments(nodes) if assignment[1]))
+
+    def shapesAssigned(self, material):
+        """Return the shapes with at least a face assigned to the material"""
+        return sorted(self.shapesByMaterial.get(material, []))
+
+    def assignation(self, material):
+        """Same as getShaderAssignation"""
+        return list(self.members.get(material, []))
+
+
 def transferMaterials(shape, toAssign, worldSpace=True):
     """Transfer materials assignation (object and faces) to a list of another objects"""
     for mesh in toAssign:
@@ -342,50 +741,148 @@ def copyUV(object, toAssign):
             logger.error('The mesh %s do not share the same topology with %s. Skipped' % (i, object))
 
 
+class ReferenceRegistry(object):
+    """Inventory of the references of the scene built once and served from memory.
+    The references and the load state and nodes of a reference are forgotten when it is loaded or unloaded (a proxy switch included),
+    everything is rebuilt when a reference is created, imported or removed, when a reference node or a referenced node is renamed,
+    when a node changes of namespace and when a scene is opened. Use getReferenceRegistry() to share the same registry.
+    """
+    SCENE_MESSAGES = ['kAfterCreateReference', 'kAfterImportReference', 'kAfterRemoveReference', 'kAfterOpen', 'kAfterNew']
+    REFERENCE_MESSAGES = ['kAfterLoadReference', 'kAfterUnloadReference']
+
+    def __init__(self):
+        self._callbacks = []
+        self.invalidate()
+
+    def invalidate(self, *args):
+        self._paths = None
+        self._references = None
+        self._loaded = {}
+        self._nodes = {}
+        self._owners = None
+
+    def _referenceChanged(self, refNode, *args):
+        name = OpenMaya.MFnDependencyNode(refNode).name()
+        self._loaded.pop(name, None)
+        self._nodes.pop((name, True), None)
+        self._nodes.pop((name, False), None)
+        self._owners = None
+        self._paths = None  # The active proxy changes with the loaded reference
+        self._references = None
+
+    def _nameChanged(self, node, previousName, *args):
+        """Renamed outside of renameReference(): the Namespace Editor, cmds.rename or cmds.file(edit=True, namespace=...)"""
+        fnNode = OpenMaya.MFnDependencyNode(node)
+        namespaceChanged = fnNode.name().rpartition(':')[0] != previousName.rpartition(':')[0]
+        if namespaceChanged or node.hasFn(OpenMaya.MFn.kReference) or fnNode.isFromReferencedFile():
+            self.invalidate()
+
+    def track(self):
+        if self._callbacks:
+            return
+        for message in self.SCENE_MESSAGES:
+            self._callbacks.append(OpenMaya.MSceneMessage.addCallback(getattr(OpenMaya.MSceneMessage, message), self.invalidate))
+        for message in self.REFERENCE_MESSAGES:
+            self._callbacks.append(OpenMaya.MSceneMessage.addReferenceCallback(getattr(OpenMaya.MSceneMessage, message), self._referenceChanged))
+        self._callbacks.append(OpenMaya.MNodeMessage.addNameChangedCallback(OpenMaya.MObject(), self._nameChanged))  # Null object for all the nodes
+
+    def untrack(self):
+        for callback in self._callbacks:
+            OpenMaya.MMessage.removeCallback(callback)
+        self._callbacks = []
+
+    @property
+    def paths(self):
+        """Return a dict {reference path: {'refNode', 'namespace', 'proxyManager'}} of every reference file, proxies included"""
+        if self._paths is None:
+            self._paths = {}
+            for path in cmds.file(query=True, reference=True):
+                refNode = cmds.referenceQuery(path, referenceNode=True)
+                connection = cmds.connectionInfo(refNode + '.proxyMsg', sourceFromDestination=True)
+                self._paths[path] = {'refNode': refNode, 'namespace': cmds.file(path, namespace=True, query=True), 'proxyManager': connection.split('.')[0] if connection else None}
+            self.refNodes = dict((values['refNode'], path) for path, values in self._paths.iteritems())
+        return self._paths
+
+    @property
+    def references(self):
+        """Return the references as getReferences, a proxy manager replaces all its proxies"""
+        if self._references is None:
+            self._references = {}
+            proxyManagers = set()
+            for path, values in self.paths.iteritems():
+                if values['proxyManager']:
+                    proxyManagers.add(values['proxyManager'])
+                else:
+                    self._references[path] = {'namespace': values['namespace'], 'proxyManager': None, 'refNode': values['refNode']}
+            for proxy in proxyManagers:
+                connection = cmds.connectionInfo(proxy + '.activeProxy', destinationFromSource=True)
+                activeProxy = cmds.listConnections(connection, source=False)[0]
+                namespace = cmds.referenceQuery(activeProxy, parentNamespace=True)[0]
+                refNode = cmds.referenceQuery(activeProxy, referenceNode=True)
+                self._references[namespace] = {'namespace': namespace, 'proxyManager': proxy, 'refNode': refNode}
+            self.namespaces = set(values['namespace'] for values in self._references.itervalues())
+        return self._references
+
+    def pathOf(self, refNode):
+        self.paths
+        return self.refNodes.get(refNode)
+
+    def isLoaded(self, refNode):
+        if refNode not in self._loaded:
+            self._loaded[refNode] = cmds.referenceQuery(refNode, isLoaded=True)
+        return self._loaded[refNode]
+
+    def nodes(self, refNode, dagPath=True):
+        if (refNode, dagPath) not in self._nodes:
+            self._nodes[(refNode, dagPath)] = cmds.referenceQuery(refNode, nodes=True, dagPath=dagPath) or []
+        return self._nodes[(refNode, dagPath)]
+
+    def referenceOf(self, node):
+        """Return the reference node containing the node, None if it is not referenced"""
+        if self._owners is None:
+            self._owners = {}
+            for values in self.paths.itervalues():
+                for i in self.nodes(values['refNode']):
+                    self._owners[i] = values['refNode']
+        return self._owners.get(node)
+
+    def namespaceExists(self, namespace):
+        self.references
+        return namespace in self.namespaces
+
+
+_referenceRegistry = None
+
+
+def getReferenceRegistry():
+    global _referenceRegistry
+    if _referenceRegistry is None:
+        _referenceRegistry = ReferenceRegistry()
+        _referenceRegistry.track()
+    return _referenceRegistry
+
+
 def getReferences(loadState=False, nodesInRef=False):
     """Returns a dictionary with the namespace as keys
     and a list containing the proxyManager if there is one, the refnode, and its load state
     """
-    result = dict()
-    proxyManagers = set()
-    references = cmds.file(query=True, reference=True)
-    for i in references:
-        refNode = cmds.referenceQuery(i, referenceNode=True)
-        connection = cmds.connectionInfo(refNode + '.proxyMsg', sourceFromDestination=True)
-        if connection:
-            proxyManagers.update([connection.split('.')[0]])
-        else:
-            namespace = cmds.file(i, parentNamespace=True, query=True)[0] + ':' + cmds.file(i, namespace=True, query=True)
-            namespace = cmds.file(i, namespace=True, query=True)
-            # namespace = ('' if namespace.startswith(':') else ':') + namespace
-            result[i] = {'namespace': namespace, 'proxyManager': None, 'refNode': refNode}
-
-    for proxy in proxyManagers:
-        connection = cmds.connectionInfo(proxy + '.activeProxy', destinationFromSource=True)
-        activeProxy = cmds.listConnections(connection, source=False)[0]
-        namespace = cmds.referenceQuery(activeProxy, parentNamespace=True)[0]
-        refNode = cmds.referenceQuery(activeProxy, referenceNode=True)
-        result[namespace] = {'proxyManager': proxy, 'refNode': refNode}
-
+    registry = getReferenceRegistry()
+    result = dict((ref, dict(values)) for ref, values in registry.references.iteritems())
     for ref in result:
         if loadState:
-            isLoaded = cmds.referenceQuery(result[ref]['refNode'], isLoaded=True)
-            result[ref]['isLoaded'] = isLoaded
+            result[ref]['isLoaded'] = registry.isLoaded(result[ref]['refNode'])
         if nodesInRef:
-            nodes = cmds.referenceQuery(result[ref]['refNode'], nodes=True, dagPath=True)
-            result[ref]['nodesInRef'] = nodes
+            result[ref]['nodesInRef'] = list(registry.nodes(result[ref]['refNode']))
     return result
 
 
 def listReferences():
     """Returns a dictionary with the path to the ref, its refNode, the nodes contained in the ref, and if the ref is loaded or not"""
-    references = cmds.file(query=True, reference=True)
+    registry = getReferenceRegistry()
     referencesDict = dict()
-    for ref in references:
-        refNode = cmds.file(ref, query=True, referenceNode=True)
-        isLoaded = cmds.referenceQuery(refNode, isLoaded=True)
-        nodesInRef = cmds.referenceQuery(refNode, nodes=True)
-        referencesDict[ref] = [refNode, nodesInRef, isLoaded]
+    for ref, values in registry.paths.iteritems():
+        refNode = values['refNode']
+        referencesDict[ref] = [refNode, list(registry.nodes(refNode, dagPath=False)), registry.isLoaded(refNode)]
     return referencesDict
 
 
@@ -395,6 +892,7 @@ def renameReference(reference, name):
     cmds.lockNode(refNode, lock=False)
     result = cmds.rename(refNode, name + 'RN')
     cmds.lockNode(result, lock=True)
+    getReferenceRegistry().invalidate()
     return result
 
 
@@ -421,7 +919,8 @@ def removeReferences(references=[]):
         cmds.file(ref, removeReference=True)
 
 
-def getIncrementedNamespace(namespace, separator='', padding=None, start=None):
+def getIncrementedNamespace(namespace, separator='', padding=None, start=None, reserved=None):
+    """Return the namespace with the next number available, the namespaces of the references are taken unless reserved is passed"""
     regex = '^(.+?){}(\d*)$'.format(re.escape(separator) + '*' if separator else separator)
     match = re.match(regex, namespace)
     base, nb = match.groups()
@@ -431,8 +930,8 @@ def getIncrementedNamespace(namespace, separator='', padding=None, start=None):
         nb = start  # force the increment to start at a specific number
     f = '{}{{:0>{}d}}'.format(separator, padding)
     namespace = base + f.format(int(nb or 1))
-    namespaces = [i['namespace'] for i in getReferences().values()]
-    while namespace in namespaces:
+    exists = reserved.__contains__ if reserved is not None else getReferenceRegistry().namespaceExists
+    while exists(namespace):
         match = re.match(regex, namespace)
         base, nb = match.groups()
         namespace = base + f.format(int(nb) + 1)
@@ -453,17 +952,79 @@ def checkReferences(padding=3):
     return tofix
 
 
-def fixReferences(padding=3, start=None):
+def planReferences(padding=3, start=None):
+    """Return the renaming needed by the references found by checkReferences, as a list of dicts
+    {'reference', 'namespace', 'refNode', 'newNamespace', 'newRefNode'}. The new namespaces are all computed up front:
+    they do not collide with each other, with the references kept or with the other namespaces of the scene.
+    """
+    getReferenceRegistry().invalidate()  # Query the namespaces again, whatever the callbacks missed
+    tofix = checkReferences(padding)
+    current = set(values['namespace'] for values in tofix.itervalues())
+    reserved = set(values['namespace'] for values in getReferences().itervalues()) - current
+    reserved.update(i.lstrip(':') for i in cmds.namespaceInfo(':', listOnlyNamespaces=True) or [])
+    reserved -= current
+    plan = []
+    for reference, values in sorted(tofix.iteritems(), key=lambda item: item[1]['namespace']):
+        namespace = getIncrementedNamespace(values['namespace'], separator='_', padding=padding, start=start, reserved=reserved)
+        reserved.add(namespace)
+        plan.append({'reference': reference, 'namespace': values['namespace'], 'refNode': values['refNode'], 'newNamespace': namespace, 'newRefNode': namespace + 'RN'})
+    return plan
+
+
+def temporaryReferenceName(name):
+    while cmds.namespace(exists=name) or cmds.objExists(name + 'RN'):
+        name += '_'
+    return name
+
+
+def applyReferencesPlan(plan):
+    """Rename the references as planned by planReferences.
+    If a new name is still used by another reference of the plan, everything is renamed to a temporary name first.
+    This is not undoable: the namespace of a reference is changed with cmds.file(edit=True), which is not recorded in the undo queue.
+    The undo is turned off during the renaming so an undo can not revert only the reference nodes. If a rename fails, the references are renamed back.
+    """
+    taken = set(libpython.flatten((i['namespace'], i['refNode']) for i in plan))
+    twoPhases = any(i['newNamespace'] in taken - set([i['namespace']]) or i['newRefNode'] in taken - set([i['refNode']]) for i in plan)
+    done = []
+    with bulkEditContext('applyReferencesPlan', undo='off', evaluation=None):
+        try:
+            if twoPhases:
+                for i, values in enumerate(plan):
+                    done.append(values)
+                    renameReference(values['reference'], temporaryReferenceName('fixReferencesTmp{}'.format(i)))
+            for values in plan:
+                if values not in done:
+                    done.append(values)
+                renameReference(values['reference'], values['newNamespace'])
+        except RuntimeError:
+            logger.error('Could not apply the references plan, rename back the {} references touched'.format(len(done)))
+            revertReferencesPlan(done)
+            raise
+    return plan
+
+
+def revertReferencesPlan(plan):
+    """Give back their namespace and reference node name to the references of the plan, through temporary names as they can be swapped"""
+    for i, values in enumerate(plan):
+        renameReference(values['reference'], temporaryReferenceName('fixReferencesRevert{}'.format(i)))
+    for values in plan:
+        cmds.file(values['reference'], edit=True, namespace=values['namespace'])
+        refNode = cmds.file(values['reference'], query=True, referenceNode=True)
+        cmds.lockNode(refNode, lock=False)
+        cmds.lockNode(cmds.rename(refNode, values['refNode']), lock=True)
+    getReferenceRegistry().invalidate()
+
+
+def fixReferences(padding=3, start=None, dryRun=False):
     """Rename namespaces and refnodes accordingly if there is a refnode named RN1/RN2/etc. or if the number of digits in the padding is incorrect, either in namespace or refnode name.
     Several references share the same namespace and could bring some bugs. Rename with the next incremented number available.
+    With dryRun nothing is renamed and the plan is returned, see planReferences.
     """
-    tofix = checkReferences(padding)
-    f = None
-    for f, values in tofix.iteritems():
-        incremented = getIncrementedNamespace(values['namespace'], separator='_', padding=padding, start=start)
-        renameReference(f, incremented)
-    if f:
-        fixReferences(padding=padding, start=start)
+    plan = planReferences(padding, start)
+    if dryRun:
+        return plan
+    if plan:
+        applyReferencesPlan(plan)
     return getReferences()
 
 
@@ -835,3 +1396,192 @@ class viewportOffContext(object):
     def __exit__(self, *exc_info):
         if self.disabled:
             cmds.paneLayout(getMayaGlobals('gMainPane'), edit=True, manage=True)
+
+
+class bulkEditContext(object):
+    """Speed up the batch operations: the main pane is hidden, the refresh suspended, the evaluation manager switched to DG and autoKey turned off.
+    undo can be 'chunk' to undo everything at once, 'off' to not record anything, or None to leave it as is.
+    evaluation is the mode of the evaluation manager, None to leave it as is when the parallel evaluation is faster like when changing the time.
+    Everything is restored even if an exception is raised. The time spent is logged, use enabled=False to log the time without the optimisations.
+    """
+    def __init__(self, label='Bulk edit', undo='chunk', evaluation='off', enabled=True):
+        self.label = label
+        self.undo = undo
+        self.evaluation = evaluation
+        self.enabled = enabled
+        self.viewport = viewportOffContext()
+
+    def __enter__(self):
+        self.start = time.time()
+        if not self.enabled:
+            return self
+        self.autoKey = cmds.autoKeyframe(query=True, state=True)
+        cmds.autoKeyframe(state=False)
+        self.evaluationMode = None
+        if self.evaluation:
+            try:
+                self.evaluationMode = libpython.getFirstItem(cmds.evaluationManager(query=True, mode=True))
+                cmds.evaluationManager(mode=self.evaluation)
+            except (AttributeError, RuntimeError, TypeError):  # No evaluation manager before Maya 2016
+                self.evaluationMode = None
+        if self.undo == 'off':
+            self.undoState = cmds.undoInfo(query=True, state=True)
+            cmds.undoInfo(stateWithoutFlush=False)
+        elif self.undo == 'chunk':
+            cmds.undoInfo(openChunk=True)
+        cmds.refresh(suspend=True)
+        self.viewport.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            self._restore([functools.partial(self.viewport.__exit__, *exc_info),
+                           functools.partial(cmds.refresh, suspend=False),
+                           self._restoreUndo,
+                           self._restoreEvaluation,
+                           functools.partial(cmds.autoKeyframe, state=self.autoKey)])
+        logger.info('{}: {:.3f}s{}'.format(self.label, time.time() - self.start, '' if self.enabled else ' (without bulkEditContext)'))
+
+    def _restoreUndo(self):
+        if self.undo == 'off':
+            cmds.undoInfo(stateWithoutFlush=self.undoState)
+        elif self.undo == 'chunk':
+            cmds.undoInfo(closeChunk=True)
+
+    def _restoreEvaluation(self):
+        if self.evaluationMode:
+            cmds.evaluationManager(mode=self.evaluationMode)
+
+    @staticmethod
+    def _restore(steps):
+        """Run every step even if some raise, the first exception is raised again once they are all done"""
+        error = None
+        for step in steps:
+            try:
+                step()
+            except Exception:
+                logger.error('Could not restore the state after the bulk edit', exc_info=True)
+                error = error or sys.exc_info()
+        if error:
+            raise error[0], error[1], error[2]
+
+# with bulkEditContext('Create nodes', undo='off'):
+#     ... your code here....
+
+
+def bulkEdit(label=None, **options):
+    """Decorator running the method in a bulkEditContext, see bulkEditContext for the options"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrap(*args, **kwargs):
+            with bulkEditContext(label or method.__name__, **options):
+                return method(*args, **kwargs)
+        return wrap
+    return decorator
+
+
+class BatchModifier(object):
+    """Queue createNode, setAttr and connectAttr and apply them all at once with a single MDagModifier.
+    The attributes are given as 'node.attribute' strings, or as (MObject, 'attribute') tuples for the nodes created in the batch.
+    The modifier is applied by the applyBatchModifier plugin command (lib/batchModifierCommand.py), the whole batch is one entry in the undo queue.
+    Like setAttr, the values of the angle, distance and time attributes are in the units of the UI.
+    """
+    ELEMENT = re.compile(r'^(\w+)\[(\d+)\]$')
+    PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'batchModifierCommand.py')
+    dagTypes = {}
+    pending = None  # Modifier taken by the plugin command when it is executed
+
+    def __init__(self):
+        self.modifier = OpenMaya.MDagModifier()
+        self.count = 0
+        self.done = False
+
+    def plug(self, nodeattr):
+        if isinstance(nodeattr, basestring):
+            return getPlug(nodeattr)
+        node, attr = nodeattr
+        match = self.ELEMENT.match(attr)
+        fnNode = OpenMaya.MFnDependencyNode(node)
+        if match:
+            return fnNode.findPlug(match.group(1)).elementByLogicalIndex(int(match.group(2)))
+        return fnNode.findPlug(attr)
+
+    def createNode(self, nodeType, name=None, parent=None):
+        """Return the MObject of the node, the DAG nodes are created under parent (an MObject) or a new transform"""
+        if nodeType not in self.dagTypes:
+            self.dagTypes[nodeType] = 'dagNode' in (cmds.nodeType(nodeType, inherited=True, isTypeName=True) or [])
+        if self.dagTypes[nodeType]:
+            node = self.modifier.createNode(nodeType, parent or OpenMaya.MObject())
+        else:
+            node = OpenMaya.MDGModifier.createNode(self.modifier, nodeType)
+        if name:
+            self.modifier.renameNode(node, name)
+        self.count += 1
+        return node
+
+    def setAttr(self, nodeattr, value):
+        """Queue the new value of the plug, compound plugs like double3 take a list of values"""
+        self._setPlug(self.plug(nodeattr), value)
+
+    def _setPlug(self, plug, value):
+        if isinstance(value, (list, tuple)):
+            for i, childValue in enumerate(value):
+                self._setPlug(plug.child(i), childValue)
+            return
+        attribute = plug.attribute()
+        if isinstance(value, (int, long, float)) and not isinstance(value, bool) and attribute.hasFn(OpenMaya.MFn.kUnitAttribute):
+            self._setUnitPlug(plug, OpenMaya.MFnUnitAttribute(attribute).unitType(), value)
+        elif isinstance(value, bool):
+            self.modifier.newPlugValueBool(plug, value)
+        elif isinstance(value, (int, long)):
+            self.modifier.newPlugValueInt(plug, value)
+        elif isinstance(value, float):
+            self.modifier.newPlugValueDouble(plug, value)
+        elif isinstance(value, basestring):
+            self.modifier.newPlugValueString(plug, value)
+        else:
+            raise TypeError('Unsupported value for {}: {}'.format(plug.name(), value))
+        self.count += 1
+
+    def _setUnitPlug(self, plug, unitType, value):
+        """Convert the value from the units of the UI, the modifier takes internal units"""
+        if unitType == OpenMaya.MFnUnitAttribute.kAngle:
+            self.modifier.newPlugValueMAngle(plug, OpenMaya.MAngle(value, OpenMaya.MAngle.uiUnit()))
+        elif unitType == OpenMaya.MFnUnitAttribute.kDistance:
+            self.modifier.newPlugValueMDistance(plug, OpenMaya.MDistance(value, OpenMaya.MDistance.uiUnit()))
+        elif unitType == OpenMaya.MFnUnitAttribute.kTime:
+            self.modifier.newPlugValueMTime(plug, OpenMaya.MTime(value, OpenMaya.MTime.uiUnit()))
+        else:
+            raise TypeError('Unsupported unit attribute: {}'.format(plug.name()))
+
+    def connectAttr(self, source, destination):
+        self.modifier.connect(self.plug(source), self.plug(destination))
+        self.count += 1
+
+    def doIt(self):
+        """Apply the batch through the plugin command, undone with cmds.undo() like any other command"""
+        start = time.time()
+        if not cmds.pluginInfo(self.PLUGIN, query=True, loaded=True):
+            cmds.loadPlugin(self.PLUGIN, quiet=True)
+        BatchModifier.pending = self.modifier
+        try:
+            cmds.applyBatchModifier()
+        finally:
+            BatchModifier.pending = None
+        self.done = True
+        logger.debug('{} operations done in {:.3f}s'.format(self.count, time.time() - start))
+
+    def nameOf(self, node):
+        return nameOfMObject(node)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *args):
+        if not exception_type:
+            self.doIt()
+
+# with BatchModifier() as batch:
+#     node = batch.createNode('multiplyDivide', name='scale_md')
+#     batch.setAttr((node, 'input2X'), 0.5)
+#     batch.connectAttr('pCube1.translateX', (node, 'input1X'))
@@ -7,20 +7,37 @@ The nodes exported is defined by the 'exportList' argument. If set to an empty l
 The maya -batch instance is executed in a thread, this way the user can still use its main Maya during the other one is processing. You can override this behaviour by setting the 'block' argument to True.
 The mayabatchExecution() function will then open the maya scene passed as argument, unpickle the object in the second argument, and execute its 'executeMayabatch' method.
 
-If maya crashes, it will execute it again 2 times.
+If maya crashes, it will execute it again 2 times, waiting retryDelay seconds then twice longer before each retry.
+The jobs that record their units of work with a lib.batchchannel.Checkpoint only execute again the units not done by the previous attempts.
 At the end, if it still crashed, it will send a mail to the user with all the log. Otherwise it will send a mail with the result (if the argument 'mailEnabled' is set).
 The mailEnabled argument is a list of two elements, the first one is the title of the tool that goes in the subject of the mail.
 The second one is the begining message you want to send. I usually recap here the elements to process.
-At the end of the mail -if the process didn't failed- it will use the last 2 lines printed in the mayabatch process (look in TheBakery module to see how I used it).
+At the end of the mail -if the process didn't failed- it will use the value returned by the 'executeMayabatch' method (look in TheBakery module to see how I used it).
+It is written with the open and execution times in a json file next to the pickle, see lib.batchchannel.
+
+The output of maya is sent line by line to the logger while it runs. The job can report its progress with lib.batchchannel.reportProgress(),
+the last event is kept in the 'progress' attribute and passed to the 'onProgress' callable if there is one.
 
 The tdStats of the original script can be passed as an argument to track the stats specific to that tool.
+
+With the 'pool' argument the job is sent to a warm mayapy worker instead of starting a new maya -batch, see lib.mayabatchpool.
+It can be True to use the shared pool, or a MayabatchPool.
+
+The jobs are queued in the scheduler of the session (see lib.scheduler) which caps the number of Maya running at once, the highest 'priority' first.
+Mayabatch.jobs() returns every job with its state, and a job can be paused, resumed or cancelled while it is queued.
+
+A watchdog kills maya with all its children if it runs longer than 'timeout' seconds, or prints nothing for 'idleTimeout' seconds, see lib.watchdog.
+A job killed that way is not executed again, it would most probably hang again.
+The peak memory, cpu time and bytes read and written by each execution are kept in the 'metrics' attribute, recorded in the stats and written in the mail.
 """
 
 
 import os
+import json
 import time
 import uuid
 import copy
+import signal
 import atexit
 import logging
 import tempfile
@@ -28,19 +45,22 @@ import threading
 import subprocess
 import maya.cmds as cmds
 import lib.stats as tdStats
+import lib.watchdog as watchdog
+import lib.scheduler as scheduler
+import lib.batchchannel as batchchannel
+import lib.mayabatchpool as mayabatchpool
 import lib.libmaya as libmaya
 import lib.libpython as libpython
 logger = logging.getLogger(__name__)
 
-
+initstats = tdStats.Stats('Mayabatch', 'regnareb', '1')
 
 
 class Mayabatch(threading.Thread):
-    instances = []
+    retryDelay = 5
 
-    def __init__(self, objectRecorded='', exportList=[], modulesExtra=False, block=False, mailEnabled=False, mailOnlyCrash=False):
+    def __init__(self, objectRecorded='', exportList=[], modulesExtra=False, block=False, mailEnabled=False, mailOnlyCrash=False, stats=None, pool=None, priority=0, onProgress=None, timeout=None, idleTimeout=None):
         super(Mayabatch, self).__init__()
-        Mayabatch.instances.append(self)
         self.__initialized  = True
         self.uuid           = uuid.uuid4().hex
         self.objectRecorded = objectRecorded
@@ -48,43 +68,189 @@ class Mayabatch(threading.Thread):
         self.modulesExtra   = modulesExtra
         self.mailEnabled    = mailEnabled
         self.mailOnlyCrash  = mailOnlyCrash
+        self.exitcode       = None
+        self.pool           = pool
+        self.priority       = priority
+        self.maya           = None
+        self.progress       = {}
+        self.onProgressCallback = onProgress
+        self.timeout        = timeout
+        self.idleTimeout    = idleTimeout
+        self.watchdog       = None
+        self.timedOut       = None
+        self.metrics        = {}
         self._stop          = threading.Event()
         self.tmp            = tempfile.gettempdir()
         atexit.register(self.stop)
+        self.formatStats(stats)
+        self.totalTime      = self.tdStats.emit('total', True)
         self.saveState()
-        # self.setDaemon(True)
-        self.start()
+        self.activePool     = None
+        self.job = scheduler.Job(scheduler.getScheduler(), self.run, priority, repr(self.objectRecorded), self.cancel)
+        self.job.mayabatch = self
+        scheduler.getScheduler().enqueue(self.job)  # Once self.job is set, run() may start right away
         if block: self.join()
 
     def __repr__(self):
-        r = super(Mayabatch, self).__repr__()
+        state = self.job.state
         if self.exitcode:
-            r = r.replace('stopped', 'crashed')
-        return r
+            state = 'crashed'
+        return '<Mayabatch {} {}>'.format(self.uuid, state)
+
+    @staticmethod
+    def jobs(state=None):
+        """Return the Mayabatch of the session, or only the ones in the state, see lib.scheduler"""
+        return [job.mayabatch for job in scheduler.getScheduler().jobs(state) if hasattr(job, 'mayabatch')]
+
+    @property
+    def state(self):
+        return self.job.state
+
+    def join(self, timeout=None):
+        """Wait for the job, even if it is still queued"""
+        self.job.wait(timeout)
+
+    def pause(self):
+        self.job.pause()
+
+    def resume(self):
+        self.job.resume()
+
+    def cancel(self):
+        """Remove the job from the queue, or kill maya or the pool worker if it is running"""
+        if self.job.state != scheduler.RUNNING:
+            self.job.cancel()
+            return
+        self.job.cancelRequested = True
+        if self.activePool:
+            self.activePool.cancel(self.uuid)
+        elif self.maya and self.maya.returncode is None:  # Not poll(), it would reap maya before waitProcess gets its rusage
+            watchdog.killProcessGroup(self.maya.pid, signal.SIGKILL)
 
     def run(self):
         tries = range(3)
         tries.reverse()
-        cmd = 'maya -batch -command \'callPython "lib.mayabatch" "mayabatchExecution" { "%s", "%s", "%s" }\'' % (self.pathScene, self.pathPickle, self.modulesExtra)
         for tries_remaining in tries:
-            self.maya          = subprocess.Popen(cmd,
-                                                  stdout=subprocess.PIPE,
-                                                  stderr=subprocess.PIPE,
-                                                  env=self.getEnvironment(),
-                                                  shell=True)
-            self.out, self.err = self.maya.communicate()
-            self.exitcode      = self.maya.returncode
+            if tries_remaining != tries[0]:
+                delay = self.retryDelay * 2 ** (tries[0] - tries_remaining - 1)
+                logger.info('{} crashed, retry in {}s'.format(self, delay))
+                time.sleep(delay)
+            if self.job.cancelRequested:
+                break
+            if self.pool:
+                self.executePool()
+            else:
+                self.executeProcess()
             logger.debug('Mayabatch out: {}'.format(self.out))
             logger.debug('Mayabatch error: {}'.format(self.err))
             logger.debug('Mayabatch exitcode: {}'.format(self.exitcode))
+            self.recordMetrics()
+            if self.job.cancelRequested:
+                break
+            if self.timedOut:
+                self.tdStats.emit(self.timedOut)
+                break
             if not self.exitcode:
                 break
             else:
                 self.tdStats.emit('crash')
+        if self.job.cancelRequested:
+            logger.info('{} cancelled'.format(self))
+            self.stop()
+            return
+        if self.exitcode:
+            logger.info('Units done kept in {}'.format(batchchannel.checkpointPath(self.pathPickle)))
+        else:
+            batchchannel.clearCheckpoint(self.pathPickle)
         self.returnSignal()
         if self.mailEnabled: self.sendMail()
         self.stop()
 
+    def executeProcess(self):
+        """Run maya -batch and stream its output line by line, the progress of the job comes through its own pipe"""
+        cmd = 'maya -batch -command \'callPython "lib.mayabatch" "mayabatchExecution" { "%s", "%s", "%s" }\'' % (self.pathScene, self.pathPickle, self.modulesExtra)
+        progressRead, progressWrite = os.pipe()
+        environment = self.getEnvironment()
+        environment[batchchannel.ENVIRONMENT] = str(progressWrite)
+        self.maya          = subprocess.Popen(cmd,
+                                              stdout=subprocess.PIPE,
+                                              stderr=subprocess.PIPE,
+                                              env=environment,
+                                              preexec_fn=lambda: prepareProcess(keep=progressWrite),
+                                              shell=True)
+        os.close(progressWrite)
+        self.watchdog = watchdog.Watchdog(self.maya.pid, self.timeout, self.idleTimeout)
+        self.watchdog.start()
+        out, err = [], []
+        readers = [startThread(self.streamLines, self.maya.stdout, out, logging.INFO),
+                   startThread(self.streamLines, self.maya.stderr, err, logging.WARNING),
+                   startThread(self.streamProgress, os.fdopen(progressRead))]
+        self.watchdog.usage = watchdog.waitProcess(self.maya)
+        self.watchdog.stop()
+        for reader in readers:
+            reader.join()
+        self.out, self.err = ''.join(out), ''.join(err)
+        self.exitcode      = self.maya.returncode
+        self.metrics       = self.watchdog.metrics
+        self.setTimedOut(self.watchdog.reason)
+
+    def streamLines(self, stream, lines, level):
+        for line in iter(stream.readline, ''):
+            lines.append(line)
+            self.watchdog.touch()
+            logger.log(level, '{}: {}'.format(self.uuid, line.rstrip()))
+        stream.close()
+
+    def streamProgress(self, stream):
+        for line in iter(stream.readline, ''):
+            self.watchdog.touch()
+            try:
+                self.onProgress(json.loads(line)['progress'])
+            except (ValueError, KeyError, TypeError):
+                logger.debug('Invalid progress: {}'.format(line))
+        stream.close()
+
+    def onProgress(self, event):
+        self.progress = event
+        logger.info('{} {}% {}'.format(self, event.get('percent', ''), event.get('message', '')))
+        if self.onProgressCallback:
+            self.onProgressCallback(self, event)
+
+    def executePool(self):
+        pool = self.pool
+        if pool is True:
+            pool = mayabatchpool.getPool(str(self.modulesExtra), env=self.getEnvironment())
+        self.activePool = pool
+        result = pool.execute({'id': self.uuid, 'scene': self.pathScene, 'pickle': self.pathPickle, 'modulesExtra': str(self.modulesExtra)}, self.onProgress, self.timeout, self.idleTimeout)
+        self.out, self.err, self.exitcode = result['out'], result['err'], result['exitcode']
+        self.metrics = result.get('metrics', {})
+        self.setTimedOut(result.get('reason'))
+
+    def setTimedOut(self, reason):
+        self.timedOut = reason
+        if reason:
+            limit = self.timeout if reason == watchdog.TIMEOUT else self.idleTimeout
+            self.err += '\nKilled by the watchdog: {} of {}s reached\n'.format(reason, limit)
+            self.exitcode = self.exitcode or 1
+
+    def recordMetrics(self):
+        """Record the resources used by the last execution in the stats, the memory and the bytes in MB"""
+        if not self.metrics:
+            return
+        logger.info('{} {}'.format(self, ', '.join('{}: {}'.format(key, value) for key, value in sorted(self.metrics.items()))))
+        self.tdStats.record('peakMemoryMB', self.metrics['peakMemory'] / 1024.0 ** 2)
+        self.tdStats.record('cpuTime', self.metrics['cpuTime'])
+        self.tdStats.record('readMB', self.metrics['readBytes'] / 1024.0 ** 2)
+        self.tdStats.record('writeMB', self.metrics['writeBytes'] / 1024.0 ** 2)
+
+    def formatMetrics(self):
+        if not self.metrics:
+            return ''
+        message = '<span style="color:#fff">Peak memory: %s</span><br />' % libpython.humansize(self.metrics['peakMemory'])
+        message += '<span style="color:#fff">CPU time: %.1fs</span><br />' % self.metrics['cpuTime']
+        message += '<span style="color:#fff">Read: %s Written: %s</span><br />' % (libpython.humansize(self.metrics['readBytes']), libpython.humansize(self.metrics['writeBytes']))
+        return message
+
     def stop(self):
         self._stop.set()
 
@@ -96,7 +262,11 @@ class Mayabatch(threading.Thread):
             logger.debug(self.out)
             logger.error('Error in thread: %s' % (self.err))
         else:
-            self.result = self.out.splitlines()[-2]
+            self.resultData = batchchannel.readResult(self.pathPickle) or {}
+            self.result = self.resultData.get('result') or ''
+            if not isinstance(self.result, basestring):
+                self.result = json.dumps(self.result)
+            self.getTimers()
             logger.info('%s' % (self.result))
 
     def saveState(self):
@@ -131,14 +301,11 @@ class Mayabatch(threading.Thread):
         self.tdStats.createSession()
 
     def getTimers(self):
-        try:
-            openTime, execTime = self.out.splitlines()[-1].split(' ')
-            t = self.tdStats.emit('open', True)
-            openTime = t.stop(openTime)
-            t = self.tdStats.emit('exec', True)
-            execTime = t.stop(execTime)
-        except (IndexError, ValueError):
-            openTime, execTime = None, None
+        openTime = self.resultData.get('openTime')
+        execTime = self.resultData.get('execTime')
+        if openTime is not None and execTime is not None:
+            openTime = self.tdStats.emit('open', True).stop(openTime)
+            execTime = self.tdStats.emit('exec', True).stop(execTime)
         self.totalTime.stop()
         self.timers = [self.totalTime.elapsed, self.saveTime.elapsed, openTime, execTime]
 
@@ -150,11 +317,13 @@ class Mayabatch(threading.Thread):
         message += '%s<br />' % (self.mailEnabled[1])
         if self.exitcode !=0:
             message += '<b style="color:red">Crashed: </b><br />' + self.err.replace('\n', '<br />') + '<br /><br /><b style="color:red">Log:</b><br /> ' + self.out.replace('\n', '<br />') + '<br />'
-            subject += ': Crashed'
+            message += self.formatMetrics()
+            subject += ': Crashed' if not self.timedOut else ': Killed ({})'.format(self.timedOut)
         else:
             message += '<b style="color:green">Success:</b><br />' + self.result.replace('\n', '<br />') + '<br /><br /><br /><br /><br />'
             for s, i in zip(['Total', 'Save', 'Open', 'Bake'], self.timers):
                 message += '<span style="color:#fff">%s time: %ss</span><br />' % (s, i)
+            message += self.formatMetrics()
             subject += ': Success'
 
         if self.mailOnlyCrash and self.exitcode !=0 or not self.mailOnlyCrash:
@@ -185,9 +354,31 @@ def mayabatchExecution(pathScene, pathPickle, modulesExtra):
     openTime = time.time() - t
     command = libpython.unPickleObject(pathPickle)
     t = time.time()
-    command.executeMayabatch()
+    batchchannel.setJob(pathPickle)
+    result = command.executeMayabatch()
     execTime = time.time() - t
-    print(openTime, execTime)
+    batchchannel.writeResult(pathPickle, result, openTime=openTime, execTime=execTime)
+
+
+def startThread(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.setDaemon(True)
+    thread.start()
+    return thread
+
+
+def prepareProcess(keep):
+    """Executed in the child process before maya: start a process group for the watchdog to kill maya with its children, and close the file descriptors"""
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    closeFileDescriptors(keep)
+
+
+def closeFileDescriptors(keep):
+    """Close the file descriptors inherited by the child process, the pipes of the other Mayabatch included, except the standard ones and keep"""
+    maxfd = os.sysconf('SC_OPEN_MAX') if hasattr(os, 'sysconf') else 256
+    os.closerange(3, keep)
+    os.closerange(keep + 1, maxfd)
 
 
 
@@ -199,6 +390,5 @@ def mayabatchExecution(pathScene, pathPickle, modulesExtra):
 class Monitor(object):
     """UI to check all the present and past jobs launched"""
     def __init__(self):
-        for i in Mayabatch.instances:
-            print(i)
-        pass
+        for i in Mayabatch.jobs():
+            print('{} priority:{} elapsed:{}'.format(i, i.priority, i.job.elapsed))
@@ -0,0 +1,179 @@
+"""
+Pool of warm mayapy workers to run the Mayabatch jobs without paying the startup of Maya for each of them.
+
+Each worker is a lib.mayabatchworker process started once, the jobs are sent as json lines on its stdin and the results read on its stdout.
+A worker is replaced after maxJobs jobs, when its memory goes over maxMemory (in bytes) or if it died.
+The workers are started on demand, up to size of them, and a job waits for a free worker if they are all busy.
+
+pool = getPool()
+result = pool.execute({'scene': '/tmp/scene.ma', 'pickle': '/tmp/scene.pickle', 'modulesExtra': False})
+result['exitcode'], result['out'], result['err']
+
+Mayabatch(objectRecorded, pool=True) submits its job to the shared pool instead of starting maya -batch.
+With stub=True the workers run the jobs without Maya, see lib.mayabatchworker.
+
+A job given a timeout or an idleTimeout (without progress reported) kills its worker when it expires, see lib.watchdog.
+The result then has the 'reason' of the kill. The 'metrics' of the result are the resources used by the job, measured by the worker.
+cancel(id) kills the worker running the job, which gives a crashed result.
+"""
+
+import os
+import sys
+import json
+import uuid
+import atexit
+import signal
+import logging
+import threading
+import subprocess
+import lib.watchdog as watchdog
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class PoolWorker(object):
+
+    def __init__(self, command, env=None):
+        self.jobs = 0
+        self.memory = 0
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, close_fds=True, preexec_fn=getattr(os, 'setsid', None))
+
+    def __repr__(self):
+        return '<PoolWorker {} jobs:{} memory:{}>'.format(self.process.pid, self.jobs, self.memory)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def submit(self, job, onProgress=None):
+        """Send the job and wait for its result, a worker dying during the job gives a crashed result.
+        The progress reported by the job is passed to onProgress until the result comes.
+        """
+        self.jobs += 1
+        try:
+            self.process.stdin.write(json.dumps(job) + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+            while line and 'progress' in json.loads(line):
+                if onProgress:
+                    onProgress(json.loads(line)['progress'])
+                line = self.process.stdout.readline()
+        except IOError as e:
+            line = ''
+            logger.debug(e)
+        if not line:
+            self.process.wait()
+            return {'id': job.get('id'), 'exitcode': self.process.returncode or 1, 'out': '', 'err': 'The worker died during the job'}
+        result = json.loads(line)
+        self.memory = result.get('memory', 0)
+        return result
+
+    def close(self):
+        if self.alive():
+            try:
+                self.process.stdin.write(json.dumps({'command': 'quit'}) + '\n')
+                self.process.stdin.close()
+            except IOError:
+                pass
+        self.process.wait()
+
+
+class MayabatchPool(object):
+
+    def __init__(self, size=2, maxJobs=20, maxMemory=None, stub=False, executable=None, env=None):
+        self.size = size
+        self.maxJobs = maxJobs
+        self.maxMemory = maxMemory
+        self.stub = stub
+        self.executable = executable
+        self.env = env
+        self.workers = []
+        self.idle = []
+        self.running = {}
+        self.condition = threading.Condition()
+
+    def getCommand(self):
+        executable = self.executable
+        if not executable:
+            executable = sys.executable if self.stub else os.path.join(os.environ['MAYA_LOCATION'], 'bin', 'mayapy')
+        return [executable, '-m', 'lib.mayabatchworker'] + (['--stub'] if self.stub else [])
+
+    def getEnvironment(self):
+        environment = dict(self.env or os.environ)
+        environment['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, environment.get('PYTHONPATH')]))
+        return environment
+
+    def acquire(self):
+        with self.condition:
+            while not self.idle and len(self.workers) >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            worker = PoolWorker(self.getCommand(), self.getEnvironment())
+            self.workers.append(worker)
+            logger.debug('Started {}'.format(worker))
+            return worker
+
+    def release(self, worker):
+        recycle = not worker.alive() or worker.jobs >= self.maxJobs or (self.maxMemory and worker.memory > self.maxMemory)
+        if recycle:
+            logger.debug('Recycle {}'.format(worker))
+            worker.close()
+        with self.condition:
+            if recycle:
+                self.workers.remove(worker)
+            else:
+                self.idle.append(worker)
+            self.condition.notify()
+
+    def execute(self, job, onProgress=None, timeout=None, idleTimeout=None):
+        """Run the job on a free worker and return its result, block until one is available"""
+        job = dict(job, id=job.get('id') or uuid.uuid4().hex)
+        worker = self.acquire()
+        self.running[job['id']] = worker
+        guard = None
+        if timeout or idleTimeout:
+            guard = watchdog.Watchdog(worker.process.pid, timeout, idleTimeout)
+            guard.start()
+        def progress(event):
+            if guard:
+                guard.touch()
+            if onProgress:
+                onProgress(event)
+        try:
+            result = worker.submit(job, progress)
+        finally:
+            if guard:
+                guard.stop()
+            self.running.pop(job['id'], None)
+            self.release(worker)
+        result['reason'] = guard.reason if guard else None
+        return result
+
+    def cancel(self, jobId):
+        """Kill the worker running the job, the worker is replaced by a new one"""
+        worker = self.running.get(jobId)
+        if worker and worker.alive():
+            watchdog.killProcessGroup(worker.process.pid, signal.SIGKILL)
+
+    def close(self):
+        with self.condition:
+            workers, self.workers, self.idle = self.workers, [], []
+        for worker in workers:
+            worker.close()
+
+
+pools = {}
+
+
+def getPool(key='default', **options):
+    """Return the shared pool for the key, created with the options the first time"""
+    if key not in pools:
+        pools[key] = MayabatchPool(**options)
+    return pools[key]
+
+
+@atexit.register
+def closePools():
+    for pool in pools.values():
+        pool.close()
@@ -0,0 +1,121 @@
+"""
+Long lived worker of the MayabatchPool, started once with mayapy and reused for many Mayabatch jobs.
+
+The jobs are read as json lines on stdin: {"id": ..., "scene": ..., "pickle": ..., "modulesExtra": ...}
+Each job runs mayabatchExecution() like a maya -batch process would, the scene is reset with a new file afterwards.
+The result is written as one json line: {"id", "exitcode", "out", "err", "memory", "metrics"}, with out holding what the job printed.
+The metrics are the peak memory, cpu time and bytes read and written during the job, like lib.watchdog measures a maya -batch.
+The progress reported by the job with lib.batchchannel comes before as {"progress": ...} lines.
+Everything else printed on stdout by Maya is redirected to stderr so it cannot be mistaken for a result.
+A {"command": "quit"} line stops the worker.
+
+With --stub the job is unpickled and executed without Maya, to test the pool.
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+import traceback
+from StringIO import StringIO
+import lib.libpython as libpython
+import lib.batchchannel as batchchannel
+import lib.watchdog as watchdog
+
+
+def getMemory(field='VmRSS'):
+    """Return the resident memory of the process in bytes, or its peak with VmHWM, 0 if it can not be read"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return 0
+
+
+def resetPeakMemory():
+    """Start the peak memory again from the current one, so VmHWM only measures the next job"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def getUsage():
+    """Return the cpu time in seconds and the bytes read and written by the process since it started"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    counters = watchdog.readIO('self')
+    return usage.ru_utime + usage.ru_stime, counters.get('read_bytes', 0), counters.get('write_bytes', 0)
+
+
+class MayaExecutor(object):
+
+    def __init__(self):
+        import maya.standalone
+        maya.standalone.initialize(name='python')
+
+    def execute(self, job):
+        import lib.mayabatch as mayabatch
+        mayabatch.mayabatchExecution(job['scene'], job['pickle'], job.get('modulesExtra', False))
+
+    def reset(self):
+        import maya.cmds as cmds
+        cmds.file(new=True, force=True)
+
+
+class StubExecutor(object):
+
+    def execute(self, job):
+        t = time.time()
+        batchchannel.setJob(job['pickle'])
+        result = libpython.unPickleObject(job['pickle']).executeMayabatch()
+        batchchannel.writeResult(job['pickle'], result, openTime=0, execTime=time.time() - t)
+
+    def reset(self):
+        pass
+
+
+def runJob(executor, job):
+    out = StringIO()
+    result = {'id': job.get('id'), 'exitcode': 0, 'err': ''}
+    resetPeakMemory()
+    usage = getUsage()
+    sys.stdout = out
+    try:
+        executor.execute(job)
+    except Exception:
+        result['exitcode'] = 1
+        result['err'] = traceback.format_exc()
+    finally:
+        sys.stdout = sys.__stdout__
+    usage = [after - before for after, before in zip(getUsage(), usage)]
+    result['metrics'] = {'peakMemory': getMemory('VmHWM'), 'cpuTime': usage[0], 'readBytes': usage[1], 'writeBytes': usage[2]}
+    try:
+        executor.reset()
+    except Exception:
+        result['err'] += traceback.format_exc()
+    result['out'] = out.getvalue()
+    result['memory'] = getMemory()
+    return result
+
+
+def main(args=None):
+    args = sys.argv[1:] if args is None else args
+    protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+    batchchannel.setStream(protocol)
+    executor = StubExecutor() if '--stub' in args else MayaExecutor()
+    for line in iter(sys.stdin.readline, ''):
+        job = json.loads(line)
+        if job.get('command') == 'quit':
+            break
+        protocol.write(json.dumps(runJob(executor, job)) + '\n')
+        protocol.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 import os
 import time
+import lib.libmaya as libmaya
 
 class SceneInfo(object):
     INTERACTIVE = 0
@@ -184,14 +185,7 @@ def nodeIsVisible(node=None):
     @property
     def referencesDict(self):
         """Returns a dictionary with the path to the ref, its refNode, the nodes contained in the ref, and if the ref is loaded or not"""
-        references = cmds.file(query=True, reference=True)
-        referencesDict = dict()
-        for ref in references:
-            refNode = cmds.file(ref, query=True, referenceNode=True)
-            isLoaded = cmds.referenceQuery(refNode, isLoaded=True)
-            nodesInRef = cmds.referenceQuery(refNode, nodes=True)
-            referencesDict[ref] = [refNode, nodesInRef, isLoaded]
-        return referencesDict
+        return libmaya.listReferences()
 
     @property
     def pluginsLoaded(self):
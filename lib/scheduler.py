@@ -0,0 +1,223 @@
+"""
+Local job queue running the Mayabatch jobs with a concurrency cap, so launching many of them does not start as many Maya at once.
+
+The highest priority job starts first, then the oldest. A job only starts if less than maxConcurrent jobs are running
+and if there is still memoryPerJob of memory available, the first job always starts whatever the memory.
+maxConcurrent defaults to half the CPU count.
+
+scheduler = getScheduler()
+job = scheduler.submit(function, priority=10, name='Bake lambert1')
+scheduler.jobs(RUNNING)  # Running jobs
+job.pause(), job.resume(), job.cancel()  # Pause or resume a queued job, cancel a queued or running one
+scheduler.pause()  # Stop starting new jobs, the running ones continue
+job.wait()
+"""
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+import multiprocessing
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+PAUSED = 'paused'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+def availableMemory():
+    """Return the available memory in bytes, None if it can not be read"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+def defaultConcurrency():
+    return max(1, multiprocessing.cpu_count() // 2)
+
+
+class Job(object):
+
+    def __init__(self, scheduler, function, priority=0, name='', onCancel=None):
+        self.scheduler = scheduler
+        self.function = function
+        self.priority = priority
+        self.name = name
+        self.onCancel = onCancel
+        self.state = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancelRequested = False
+        self.event = threading.Event()
+
+    def __repr__(self):
+        return '<Job {} {} priority:{}>'.format(self.name, self.state, self.priority)
+
+    def pause(self):
+        self.scheduler.pauseJob(self)
+
+    def resume(self):
+        self.scheduler.resumeJob(self)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        return self.event.isSet()
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return None
+        return (self.finished or time.time()) - self.started
+
+
+class Scheduler(object):
+
+    def __init__(self, maxConcurrent=None, memoryPerJob=4 * 1024 ** 3):
+        self.maxConcurrent = maxConcurrent or defaultConcurrency()
+        self.memoryPerJob = memoryPerJob
+        self.queue = []
+        self.history = []
+        self.running = set()
+        self.paused = False
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        self.dispatcher = None
+
+    def submit(self, function, priority=0, name='', onCancel=None):
+        return self.enqueue(Job(self, function, priority, name, onCancel))
+
+    def enqueue(self, job):
+        """Queue a job created beforehand, when the function needs its job before it can be started"""
+        with self.condition:
+            heapq.heappush(self.queue, (-job.priority, next(self.counter), job))
+            self.history.append(job)
+            self.condition.notify_all()
+        self._startDispatcher()
+        return job
+
+    def jobs(self, state=None):
+        """Return the jobs submitted, or only the ones in the state"""
+        return [job for job in self.history if state is None or job.state == state]
+
+    def pause(self):
+        with self.condition:
+            self.paused = True
+
+    def resume(self):
+        with self.condition:
+            self.paused = False
+            self.condition.notify_all()
+
+    def pauseJob(self, job):
+        with self.condition:
+            if job.state == QUEUED:
+                job.state = PAUSED
+
+    def resumeJob(self, job):
+        with self.condition:
+            if job.state == PAUSED:
+                job.state = QUEUED
+                self.condition.notify_all()
+
+    def cancel(self, job):
+        """A queued job is removed, a running one is asked to stop through its onCancel"""
+        with self.condition:
+            if job.state in (QUEUED, PAUSED):
+                self._finish(job, CANCELLED)
+                return
+            if job.state != RUNNING:
+                return
+            job.cancelRequested = True
+        if job.onCancel:
+            job.onCancel()
+
+    def canStart(self):
+        if self.paused or len(self.running) >= self.maxConcurrent:
+            return False
+        if not self.running or not self.memoryPerJob:
+            return True
+        memory = availableMemory()
+        return memory is None or memory >= self.memoryPerJob
+
+    def _next(self):
+        """Return the next queued job, the paused ones are kept in the queue"""
+        skipped = []
+        job = None
+        while self.queue:
+            item = heapq.heappop(self.queue)
+            if item[2].state == QUEUED:
+                job = item[2]
+                break
+            if item[2].state == PAUSED:
+                skipped.append(item)
+        for item in skipped:
+            heapq.heappush(self.queue, item)
+        return job
+
+    def _startDispatcher(self):
+        with self.condition:
+            if self.dispatcher and self.dispatcher.is_alive():
+                return
+            self.dispatcher = threading.Thread(target=self._dispatch, name='Scheduler')
+            self.dispatcher.setDaemon(True)
+            self.dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            with self.condition:
+                job = None
+                while job is None:
+                    if self.canStart():
+                        job = self._next()
+                    if job is None:
+                        self.condition.wait(5)  # Check the available memory again from time to time
+                job.state = RUNNING
+                job.started = time.time()
+                self.running.add(job)
+            thread = threading.Thread(target=self._run, args=(job,), name=job.name or 'Job')
+            thread.setDaemon(True)
+            thread.start()
+
+    def _run(self, job):
+        state = DONE
+        try:
+            job.result = job.function()
+        except Exception as e:
+            logger.error(e, exc_info=True)
+            job.error = e
+            state = FAILED
+        with self.condition:
+            self.running.discard(job)
+            self._finish(job, CANCELLED if job.cancelRequested else state)
+            self.condition.notify_all()
+
+    def _finish(self, job, state):
+        job.state = state
+        job.finished = time.time()
+        job.event.set()
+
+
+scheduler = None
+
+
+def getScheduler():
+    """Return the scheduler shared by all the Mayabatch of the session"""
+    global scheduler
+    if scheduler is None:
+        scheduler = Scheduler()
+    return scheduler
@@ -14,6 +14,9 @@ event = stats.emit('exec', True)
 event.stop()
 You can call the event.stop() even if you didn't specified you wanted a timer, but it will not track if the event crashed during the execution then.
 
+To record a value that is not a time, like the memory used by a process, use record(). The value goes in the timer field:
+stats.record('peakMemoryMB', 2048.5)
+
 
 
 The main object 'Stats' fot for arguments: toolname (string), author (string), version (string)
@@ -138,7 +141,7 @@ class Stats(object):
 
     def isUserValid(self):
         '''Do not register some users.'''
-        special_users = ['captain3d'. 'regnareb']
+        special_users = ['captain3d', 'regnareb']
         if self.params['user'] in special_users:
             self.params['table'] = 'developers'
             return False
@@ -147,6 +150,9 @@ class Stats(object):
     def emit(self, status, timer=False):
         return Row(status=status, timer=timer, **self.params)
 
+    def record(self, status, value):
+        return Row(status=status, timer=True, value=value, **self.params)
+
 
 
 
@@ -161,7 +167,7 @@ class Row(object):
             setattr(self, key, value)
         self.lock = threading.Lock()
         self.datetimer = Datetimer()
-        self.datetimer.elapsed = 0 if kwargs['timer'] else ''
+        self.datetimer.elapsed = kwargs.get('value', 0 if kwargs['timer'] else '')
         self.start()
 
     def connect(self, sql):
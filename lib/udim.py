@@ -0,0 +1,101 @@
+"""
+Compute the UDIM tiles of meshes from their UV arrays.
+
+The UVs and the UV ids of every face are read once per mesh with MFnMesh and the tiles of all the faces are computed at once,
+instead of one polyListComponentConversion/polyEditUV round trip per face:
+getTiles(['|asset|body', '|asset|head.f[0:199]'])  # [[0, 0], [1, 0], [0, 1]]
+getUDIM('|asset|head.f[0:199]')  # [0, 0], the lowest tile like libmaya.getUDIM
+udimNumbers([[0, 0], [1, 0], [0, 1]])  # [1001, 1002, 1011]
+
+The tile of a face is the one of its lowest U and lowest V, the faces without UVs are ignored.
+"""
+
+import re
+import logging
+import numpy
+import maya.cmds as cmds
+import maya.OpenMaya as OpenMaya
+logger = logging.getLogger(__name__)
+
+FACES = re.compile(r'^f\[(\d+)(?::(\d+))?\]$')
+
+
+def getMeshFn(mesh):
+    selection = OpenMaya.MSelectionList()
+    selection.add(mesh)
+    dagPath = OpenMaya.MDagPath()
+    selection.getDagPath(0, dagPath)
+    return OpenMaya.MFnMesh(dagPath)
+
+
+def getMeshes(node):
+    """Return the meshes of a node, the node itself if it is a mesh or the shapes of a transform"""
+    return cmds.ls(node, type='mesh', long=True) or cmds.listRelatives(node, shapes=True, noIntermediate=True, fullPath=True, type='mesh') or []
+
+
+def parseFaces(components):
+    """Return a dict {mesh: face indices} of a list of meshes, transforms and face components, the indices are None for whole meshes"""
+    meshes = {}
+    for component in cmds.ls(components, long=True):
+        node, _, faces = component.partition('.')
+        match = FACES.match(faces)
+        for mesh in getMeshes(node):
+            if not faces:
+                meshes[mesh] = None
+            elif match and meshes.get(mesh, []) is not None:
+                first, last = match.groups()
+                meshes.setdefault(mesh, []).extend(xrange(int(first), int(last or first) + 1))
+            elif not match:
+                logger.warning('{} is not a face component, it is ignored'.format(component))
+    return meshes
+
+
+def faceTiles(mesh, faces=None, uvSet=None):
+    """Return a (N, 2) array of the tile (U, V) of each face with UVs, of all the faces of the mesh or only the ones passed"""
+    fnMesh = getMeshFn(mesh)
+    us = OpenMaya.MFloatArray()
+    vs = OpenMaya.MFloatArray()
+    uvCounts = OpenMaya.MIntArray()
+    uvIds = OpenMaya.MIntArray()
+    fnMesh.getUVs(us, vs, uvSet)
+    fnMesh.getAssignedUVs(uvCounts, uvIds, uvSet)
+    counts = numpy.array(list(uvCounts), dtype=int)
+    ids = numpy.array(list(uvIds), dtype=int)
+    if not len(ids):
+        return numpy.zeros((0, 2), dtype=int)
+    offsets = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    mapped = counts > 0
+    tiles = numpy.zeros((len(counts), 2), dtype=int)
+    tiles[mapped, 0] = numpy.floor(numpy.minimum.reduceat(numpy.array(list(us))[ids], offsets[mapped]))
+    tiles[mapped, 1] = numpy.floor(numpy.minimum.reduceat(numpy.array(list(vs))[ids], offsets[mapped]))
+    if faces is not None:
+        faces = numpy.asarray(faces, dtype=int)
+        return tiles[faces[mapped[faces]]]
+    return tiles[mapped]
+
+
+def getTiles(components, uvSet=None):
+    """Return the sorted list of the tiles [U, V] used by the faces of meshes, transforms or face components"""
+    tiles = [faceTiles(mesh, faces, uvSet) for mesh, faces in parseFaces(components).iteritems()]
+    if not tiles:
+        return []
+    tiles = numpy.unique(numpy.concatenate(tiles), axis=0)
+    return sorted([int(u), int(v)] for u, v in tiles)
+
+
+def getUDIM(components, uvSet=None):
+    """Return the lowest tile [Umin, Vmin] of the faces, a replacement of libmaya.getUDIM"""
+    tiles = getTiles(components, uvSet)
+    if not tiles:
+        return None
+    return [min(i[0] for i in tiles), min(i[1] for i in tiles)]
+
+
+def uvToUdim(uvs):
+    """Return the UDIM numbers of an array of UV coordinates, a vectorized libmaya.uvToUdim"""
+    return udimNumbers(numpy.floor(numpy.asarray(uvs, dtype=float)))
+
+
+def udimNumbers(tiles):
+    tiles = numpy.asarray(tiles, dtype=int).reshape(-1, 2)
+    return [int(i) for i in 1001 + tiles[:, 0] + 10 * tiles[:, 1]]
@@ -0,0 +1,130 @@
+"""
+Store the visibility of nodes per frame for several cameras, as computed by the FrustumScanner.
+
+Each camera has a nodes x frames boolean matrix, so the queries are simple slices:
+store = VisibilityStore(nodes, 1, 250)
+store.setVisible('shotCam', 12, ['|set|tree1', '|set|tree2'])
+store.framesVisible('shotCam', '|set|tree1')  # [12]
+store.nodesVisible('shotCam', 12)  # ['|set|tree1', '|set|tree2']
+store.union('shotCam', 1, 100)  # Every node visible at least once between frames 1 and 100
+
+It can be saved to a json file where each node keeps only the runs of frames where it is visible, the render preparation tools can then load it instead of scanning again:
+store.save('/path/visibility.json')
+store = VisibilityStore.load('/path/visibility.json')
+"""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+import libpython
+
+
+class VisibilityStore(object):
+    VERSION = 1
+
+    def __init__(self, nodes, begin, end):
+        """begin and end are both included"""
+        if numpy is None:
+            raise RuntimeError('numpy is needed to store the visibility')
+        self.nodes = list(nodes)
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        self.begin = int(begin)
+        self.end = int(end)
+        self.matrices = {}
+
+    @property
+    def cameras(self):
+        return sorted(self.matrices)
+
+    def matrix(self, camera):
+        if camera not in self.matrices:
+            self.matrices[camera] = numpy.zeros((len(self.nodes), self.end - self.begin + 1), dtype=bool)
+        return self.matrices[camera]
+
+    def _column(self, frame):
+        frame = int(frame)
+        if not self.begin <= frame <= self.end:
+            raise IndexError('Frame {} out of the range {}-{}'.format(frame, self.begin, self.end))
+        return frame - self.begin
+
+    def setVisible(self, camera, frame, nodes):
+        """Set the nodes visible at that frame, the other ones are set invisible"""
+        column = self.matrix(camera)[:, self._column(frame)]
+        column[:] = False
+        column[[self.index[node] for node in nodes]] = True
+
+    def setRange(self, camera, begin, end, nodes):
+        """Set the same visibility for all the frames between begin and end included"""
+        matrix = self.matrix(camera)
+        columns = slice(self._column(begin), self._column(end) + 1)
+        matrix[:, columns] = False
+        matrix[[self.index[node] for node in nodes], columns] = True
+
+    def framesVisible(self, camera, node):
+        if camera not in self.matrices:
+            return []
+        return [int(i) + self.begin for i in numpy.flatnonzero(self.matrices[camera][self.index[node]])]
+
+    def nodesVisible(self, camera, frame):
+        if camera not in self.matrices:
+            return []
+        return [self.nodes[i] for i in numpy.flatnonzero(self.matrices[camera][:, self._column(frame)])]
+
+    def union(self, camera, begin=None, end=None):
+        """Return the nodes visible at least once between begin and end included"""
+        if camera not in self.matrices:
+            return []
+        begin = self.begin if begin is None else max(begin, self.begin)
+        end = self.end if end is None else min(end, self.end)
+        if begin > end:
+            return []
+        visible = self.matrices[camera][:, self._column(begin):self._column(end) + 1].any(axis=1)
+        return [self.nodes[i] for i in numpy.flatnonzero(visible)]
+
+    def toRuns(self, camera):
+        """Return the visible frames of each node as a flat list of [start, length, start, length...] relative to begin"""
+        matrix = self.matrix(camera)
+        padded = numpy.zeros((matrix.shape[0], matrix.shape[1] + 2), dtype=numpy.int8)
+        padded[:, 1:-1] = matrix
+        rows, starts = numpy.nonzero(numpy.diff(padded, axis=1) == 1)
+        ends = numpy.nonzero(numpy.diff(padded, axis=1) == -1)[1]
+        runs = {}
+        for row, start, end in zip(rows, starts, ends):
+            runs.setdefault(int(row), []).extend([int(start), int(end - start)])
+        return runs
+
+    def fromRuns(self, camera, runs):
+        matrix = self.matrix(camera)
+        for row, values in runs.iteritems():
+            for start, length in zip(values[::2], values[1::2]):
+                matrix[int(row), start:start + length] = True
+
+    def save(self, path):
+        data = {'version': self.VERSION,
+                'begin': self.begin,
+                'end': self.end,
+                'nodes': self.nodes,
+                'cameras': dict((camera, self.toRuns(camera)) for camera in self.matrices)}
+        libpython.jsonWrite(data, path)
+
+    @classmethod
+    def load(cls, path):
+        data = libpython.jsonLoad(path)
+        store = cls(data['nodes'], data['begin'], data['end'])
+        for camera, runs in data['cameras'].iteritems():
+            store.fromRuns(camera, runs)
+        return store
+
+    @classmethod
+    def fromDict(cls, visibility, nodes=None):
+        """Create a store from a {camera: {frame: [nodes]}} dictionary"""
+        frames = [int(frame) for frames in visibility.values() for frame in frames]
+        if nodes is None:
+            nodes = sorted(set(libpython.flatten(frames.values() for frames in visibility.values())))
+        store = cls(nodes, min(frames or [0]), max(frames or [0]))
+        for camera, frames in visibility.iteritems():
+            for frame, visible in frames.iteritems():
+                store.setVisible(camera, frame, visible)
+        return store
@@ -0,0 +1,167 @@
+"""
+Watchdog of a batch process: it kills the whole process group when the process runs longer than timeout seconds,
+or when it prints nothing for idleTimeout seconds, and it samples from /proc the resources used while it runs.
+
+The process has to lead its own process group (started with preexec_fn=os.setsid) so the shell, maya and their children are killed together.
+They are first asked to terminate, and killed if they are still there after grace seconds.
+
+watchdog = Watchdog(process.pid, timeout=3600, idleTimeout=600)
+watchdog.start()
+watchdog.touch()  # Each time the process prints something
+watchdog.usage = waitProcess(process)
+watchdog.stop()
+watchdog.reason  # None, TIMEOUT or IDLE
+watchdog.metrics  # {'peakMemory': bytes, 'cpuTime': seconds, 'readBytes': bytes, 'writeBytes': bytes}
+
+The cpu time and the bytes read and written come from the rusage of the process given by waitProcess(), its children waited for included.
+The peak memory is sampled every interval seconds, it is the highest of the sum of the group and of the rusage peak of a single process.
+Without rusage every metric comes from the samples, what a process does after the last sample is not counted.
+"""
+
+import os
+import time
+import errno
+import signal
+import logging
+import threading
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 'timeout'
+IDLE = 'idle'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def readStat(pid):
+    """Return the fields of /proc/pid/stat after the name of the process, None if it can not be read"""
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except (IOError, IndexError):
+        return None
+
+
+def readIO(pid):
+    """Return the counters of /proc/pid/io, empty if they can not be read"""
+    counters = {}
+    try:
+        with open('/proc/{}/io'.format(pid)) as f:
+            for line in f:
+                key, value = line.split(':')
+                counters[key] = int(value)
+    except (IOError, ValueError):
+        pass
+    return counters
+
+
+def sampleProcessGroup(pgid):
+    """Return {pid: (memory, cpuTime, readBytes, writeBytes)} for the processes of the group"""
+    sample = {}
+    if not os.path.isdir('/proc'):
+        return sample
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        stat = readStat(name)
+        if not stat or int(stat[2]) != pgid:
+            continue
+        counters = readIO(name)
+        cpuTime = (int(stat[11]) + int(stat[12])) / float(CLOCK_TICKS)
+        sample[int(name)] = (int(stat[21]) * PAGE_SIZE, cpuTime, counters.get('read_bytes', 0), counters.get('write_bytes', 0))
+    return sample
+
+
+def killProcessGroup(pid, sig=signal.SIGTERM):
+    """Send the signal to the process group led by pid, or only to the process if there are no process groups"""
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(pid, sig)
+        else:
+            os.kill(pid, sig)
+    except OSError:
+        pass  # Already finished
+
+
+def waitProcess(process):
+    """Wait for the subprocess.Popen and return its rusage, None if it can not be read"""
+    if not hasattr(os, 'wait4'):
+        process.wait()
+        return None
+    while True:
+        try:
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            process.wait()  # Already waited for somewhere else
+            return None
+    process._handle_exitstatus(status)
+    return usage
+
+
+class Watchdog(threading.Thread):
+
+    def __init__(self, pid, timeout=None, idleTimeout=None, interval=1, grace=10):
+        super(Watchdog, self).__init__(name='Watchdog {}'.format(pid))
+        self.setDaemon(True)
+        self.pid = pid
+        self.timeout = timeout
+        self.idleTimeout = idleTimeout
+        self.interval = interval
+        self.grace = grace
+        self.reason = None
+        self.peakMemory = 0
+        self.processes = {}
+        self.usage = None
+        self.started = self.lastActivity = time.time()
+        self._stop = threading.Event()
+
+    def touch(self):
+        self.lastActivity = time.time()
+
+    def run(self):
+        self.sample()
+        while not self._stop.wait(self.interval):
+            self.sample()
+            reason = self.expired()
+            if reason:
+                self.kill(reason)
+                break
+
+    def sample(self):
+        processes = sampleProcessGroup(self.pid)
+        self.peakMemory = max(self.peakMemory, sum(values[0] for values in processes.values()))
+        self.processes.update(processes)  # Keep the last values of the processes already finished
+
+    def expired(self):
+        now = time.time()
+        if self.timeout and now - self.started > self.timeout:
+            return TIMEOUT
+        if self.idleTimeout and now - self.lastActivity > self.idleTimeout:
+            return IDLE
+        return None
+
+    def kill(self, reason=None):
+        self.reason = reason
+        logger.warning('Kill the process group {} ({})'.format(self.pid, reason))
+        killProcessGroup(self.pid, signal.SIGTERM)
+        if not self._stop.wait(self.grace):
+            killProcessGroup(self.pid, signal.SIGKILL)
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def metrics(self):
+        if self.usage is not None:
+            # ru_maxrss is in kilobytes, the blocks of ru_inblock and ru_oublock are 512 bytes
+            return {'peakMemory': max(self.peakMemory, self.usage.ru_maxrss * 1024),
+                    'cpuTime': self.usage.ru_utime + self.usage.ru_stime,
+                    'readBytes': self.usage.ru_inblock * 512,
+                    'writeBytes': self.usage.ru_oublock * 512}
+        processes = self.processes.values()
+        return {'peakMemory': self.peakMemory,
+                'cpuTime': sum(values[1] for values in processes),
+                'readBytes': sum(values[2] for values in processes),
+                'writeBytes': sum(values[3] for values in processes)}
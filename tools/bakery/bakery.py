@@ -1,14 +1,20 @@
 import os
 import re
 import copy
+import time
 import logging
 import itertools
 import maya.mel as mel
 import maya.cmds as cmds
 import tempfile
 import lib.libmaya as libmaya
-import lib.libmaya as libpython
+import lib.libpython as libpython
 import lib.mayabatch as mayabatch
+import lib.batchchannel as batchchannel
+try:
+    import lib.udim as udim
+except ImportError:
+    udim = None
 
 logger = logging.getLogger(__name__)
 
@@ -18,13 +24,17 @@ class NoAssignation(ValueError):
 
 class Shader(object):
     instances = []
-    def __init__(self, shaderName, mode, renderAttr, shaderAttr):
+    def __init__(self, shaderName, mode, renderAttr, shaderAttr, shadingIndex=None):
         self.mode = mode
         self.name = shaderName
-        self.shadingGroup = libmaya.getSGsFromMaterial(shaderName)[0]
+        if shadingIndex:
+            self.shadingGroup = shadingIndex.shadingEngines[shaderName][0]
+            self.assignation = shadingIndex.assignation(shaderName)
+        else:
+            self.shadingGroup = libmaya.getSGsFromMaterial(shaderName)[0]
+            self.assignation = libmaya.getShaderAssignation(shaderName)
         self.renderAttr = renderAttr
         self.shaderAttr = shaderAttr
-        self.assignation = libmaya.getShaderAssignation(shaderName)
         self.shapes = self.getShapes()
         self.udims = self.getAllUDIMs()
         self.udimsTotal = copy.copy(self.udims)
@@ -48,18 +58,20 @@ class Shader(object):
         return shapes
 
     def getAllUDIMs(self):
-        udim = []
+        if udim is not None:
+            return udim.getTiles(self.assignation)
+        tiles = []
         for i in self.assignation:
             if '.' not in i:
                 faceList = cmds.ls(i + '.f[*]', flatten=True)
             else:
                 faceList = cmds.ls(i, flatten=True)
             for face in faceList:
-                udim.append(libmaya.getUDIM(face))
+                tiles.append(libmaya.getUDIM(face))
 
-        udim.sort()
-        udim = list(k for k,_ in itertools.groupby(udim))
-        return udim
+        tiles.sort()
+        tiles = list(k for k,_ in itertools.groupby(tiles))
+        return tiles
 
     def getTexturePath(self):
         folder, assetName = self.getExportPath(self.mode)
@@ -86,6 +98,9 @@ class Bakery(object):
         self.result = []
         self.toBake = []
         self.shaders = Shader.instances
+        self.batchTimeouts = {'timeout': None,  # Seconds, see lib.mayabatch, None to never kill the batch
+                              'idleTimeout': 3600
+                              }
         self.renderAttr = {'resolution': 2048,
                            'alpha': 0,
                            'merge': 1,
@@ -149,17 +164,18 @@ class Bakery(object):
     def addShaders(self, mode):
         shaders = []
         selection = cmds.ls(sl=True, geometry=True, transforms=True)
-        shaderList = [libmaya.getMaterialFromSG(sg) for sublist in [libmaya.getSGsFromShape(shape) for shape in selection] for sg in sublist]
+        shadingIndex = libmaya.ShadingIndex()
+        shaderList = shadingIndex.materialsOf(selection)
         shaderList += cmds.ls(sl=True, materials=True)
         shaderList = list(set(shaderList))
         for shaderName in shaderList:
-            shader = self.addShader(shaderName, mode)
+            shader = self.addShader(shaderName, mode, shadingIndex)
             shaders.extend([shader])
         return filter(None, shaders)
 
-    def addShader(self, shaderName, mode):
+    def addShader(self, shaderName, mode, shadingIndex=None):
         try:
-            shader = Shader(shaderName, mode, self.renderAttr.copy(), self.shaderAttr[mode].copy())
+            shader = Shader(shaderName, mode, self.renderAttr.copy(), self.shaderAttr[mode].copy(), shadingIndex)
             return shader
         except NoAssignation:
             logger.error('Shader not added, no shapes assigned to the shader')
@@ -219,7 +235,7 @@ class Bakery(object):
         old = self.prepared
         self.prepared = False
         cmds.savePrefs(general=True)
-        mayabatch.Mayabatch(objectRecorded=self, exportList=self.mergeExportList(), mailEnabled=self.mail(), modulesExtra=True)
+        mayabatch.Mayabatch(objectRecorded=self, exportList=self.mergeExportList(), mailEnabled=self.mail(), modulesExtra=True, **self.batchTimeouts)
         self.prepared = old
 
     def createShaders(self):
@@ -395,13 +411,21 @@ class Bakery(object):
             print 'Shader Attr: ', shader.shaderAttr
         # Assign surfaceshader noir sur tous les meshes ?
 
-        for shader in self.toBake or self.shaders:
-            for udim in shader.udims:
-                filename = '{}.10{}{}.tga'.format(shader.fileName, udim[1], udim[0]+1)
-                cmd = self.constructTurtleCommand(shader, udim, filename)
-                libpython.createDir(shader.texturePath) # Create directory?
-                self.bakeShader(shader, cmd)
-                fullpath = libpython.normpath(os.path.join(shader.texturePath, filename))
-                self.result.append('<a href="file://{0}" {1}>{0}</a> - <a href="rvlink://{0}" {1}>Open in RV</a>'.format(fullpath, 'style="text-decoration: none"'))
-
-        print '<br />'.join(self.result) # This is used by the Mayabatch lib to send the result by mail.
+        # One unit of work per shader and UDIM, a retry after a crash only bakes the ones not done yet
+        units = [(shader, udim) for shader in self.toBake or self.shaders for udim in shader.udims]
+        keys = [[shader.name, shader.mode, udim] for shader, udim in units]
+        checkpoint = batchchannel.getCheckpoint()
+        for i, (shader, udim) in enumerate(units):
+            if checkpoint.isDone(keys[i]):
+                continue
+            start = time.time()
+            filename = '{}.10{}{}.tga'.format(shader.fileName, udim[1], udim[0]+1)
+            cmd = self.constructTurtleCommand(shader, udim, filename)
+            libpython.createDir(shader.texturePath) # Create directory?
+            self.bakeShader(shader, cmd)
+            fullpath = libpython.normpath(os.path.join(shader.texturePath, filename))
+            checkpoint.complete(keys[i], '<a href="file://{0}" {1}>{0}</a> - <a href="rvlink://{0}" {1}>Open in RV</a>'.format(fullpath, 'style="text-decoration: none"'))
+            batchchannel.reportProgress(percent=100.0 * (i + 1) / len(units), message='{} {} baked'.format(shader.name, filename), shader=shader.name, udim=udim, time=time.time() - start)
+
+        self.result = checkpoint.results(keys)
+        return '<br />'.join(self.result) # This is used by the Mayabatch lib to send the result by mail.
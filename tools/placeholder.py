@@ -8,6 +8,11 @@ import maya.cmds as cmds
 import pymel.core as pmc
 import lib.lib as tdLib
 import lib.stats as tdStats
+try:
+    import lib.udim as udim
+except ImportError:
+    udim = None
+import lib.libmaya as libmaya
 logger = logging.getLogger(__name__)
 
 initstats = tdStats.Stats('OutPlaceholder', 'regnareb', '1')
@@ -59,15 +64,16 @@ class Placeholder():
         return pathHigh
 
     def reinitialise_texture(self):
-        for shader, attr in self.shaders.items():
-            texture = attr[2]
-            placed2dtexture = attr[3]
-            cmds.setAttr(placed2dtexture + '.rotateFrame', 0)
-            cmds.setAttr(placed2dtexture + '.repeatU', 1)
-            cmds.setAttr(placed2dtexture + '.repeatV', 1)
-            cmds.setAttr(placed2dtexture + '.offsetU', 0)
-            cmds.setAttr(placed2dtexture + '.offsetV', 0)
-            cmds.setAttr(texture + '.fileTextureName', cmds.getAttr(texture + '.fileTextureName'), type='string')
+        with libmaya.BatchModifier() as batch:
+            for shader, attr in self.shaders.items():
+                texture = attr[2]
+                placed2dtexture = attr[3]
+                batch.setAttr(placed2dtexture + '.rotateFrame', 0.0)
+                batch.setAttr(placed2dtexture + '.repeatU', 1.0)
+                batch.setAttr(placed2dtexture + '.repeatV', 1.0)
+                batch.setAttr(placed2dtexture + '.offsetU', 0.0)
+                batch.setAttr(placed2dtexture + '.offsetV', 0.0)
+                batch.setAttr(texture + '.fileTextureName', cmds.getAttr(texture + '.fileTextureName'))
 
     def extract_combine(self, assignation):
         mesh = list(set([mesh.split('.')[0] for mesh in assignation]))
@@ -81,7 +87,12 @@ class Placeholder():
             assignation = attr[0]
             path = attr[1]
             texture = attr[2]
-            Umin, Vmin = tdLib.getUDIM(assignation)
+            tile = udim.getUDIM(assignation) if udim is not None else tdLib.getUDIM(assignation)
+            if tile is None:
+                logger.warning('No UVs found for {}, it is not baked'.format(shader))
+                t.stop()
+                continue
+            Umin, Vmin = tile
             with tdLib.UndoContext():
                 assignation = self.extract_combine(assignation)
                 dummyFile = cmds.convertSolidTx(texture + '.outColor', assignation, fileImageName=path, antiAlias=1, backgroundMode=2, resolutionX=512, resolutionY=512, fileFormat='tga', uvRange=[Umin, Umin+1, Vmin, Vmin+1])